@@ -0,0 +1,151 @@
+import argparse
+import bz2
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks.generate_dataset import DatasetGenerator
+from src.analysis.alsoLikesAnalyzer import AlsoLikesAnalyzer
+from src.analysis.alsoLikesStore import AlsoLikesStore
+from src.analysis.compressed_source import CompressedSource
+from src.analysis.data_handler import DataHandler
+from src.analysis.event_aggregates import EventAggregates
+
+class ConsistencyCheck:
+
+    """ Checks that the alternative ways of reading a log give the results of the plain serial scan.
+
+    Covers parallel shards, the Parquet cache, the -d filter, multi-member gzip and bz2 files split on member
+    boundaries, and incremental versus one-shot store ingestion, on a generated dataset. """
+
+    TASKS = ['2a', '3a', '4', '5d']
+
+    # Lines per compressed member; small enough that the files split into several ranges
+    MEMBER_LINES = 1000
+
+    # Documents whose top 10 also-liked documents are compared, besides the dataset's sample document
+    ALSO_LIKES_DOCUMENTS = 200
+
+    def __init__(self, scale='small', workers=3):
+        self.scale = scale
+        self.workers = workers
+        self.failures = []
+
+    @staticmethod
+    def summary(aggregates, doc_uuid):
+        """ Everything a task prints, in a form that compares equal only when the results are identical. """
+        pairs = aggregates.reading_pairs()
+        ordered = pairs.astype(str).sort_values(['visitor_uuid', 'subject_doc_id'])
+        return {
+            'countries': list(aggregates.country_counts().items()),
+            'user agents': list(aggregates.browser_counts(detailed=True).items()),
+            'top readers': list(aggregates.top_readers(20).items()),
+            'reading pairs': list(ordered.itertuples(index=False, name=None)),
+            # Tasks 5d and 6 rank by these counts; many documents, so some top 10s end inside a run of ties
+            'also likes': ConsistencyCheck.also_likes(pairs, doc_uuid),
+        }
+
+    @staticmethod
+    def also_likes(pairs, doc_uuid):
+        analytics = AlsoLikesAnalyzer(pairs)
+        documents = [doc_uuid] + sorted(pairs['subject_doc_id'].astype(str).unique())[:ConsistencyCheck.ALSO_LIKES_DOCUMENTS]
+        return [(document, list(analytics.get_top_10_also_likes(document).items())) for document in documents]
+
+    def compare(self, label, expected, actual):
+        different = [name for name in expected if expected[name] != actual[name]]
+        print(f"{'FAIL' if different else 'ok  '} {label}" + (f" ({', '.join(different)} differ)" if different else ''))
+        if different:
+            self.failures.append(label)
+
+    @staticmethod
+    def write_members(source, target, compress):
+        """ Copy a JSON lines file as one independently compressed member per MEMBER_LINES lines. """
+        with open(source, 'rb') as handle, open(target, 'wb') as output:
+            lines = handle.readlines()
+            for start in range(0, len(lines), ConsistencyCheck.MEMBER_LINES):
+                output.write(compress(b''.join(lines[start:start + ConsistencyCheck.MEMBER_LINES])))
+
+    def check_readers(self, path, doc_uuid, workdir):
+        DataHandler.use_cache = False
+        for doc in (None, doc_uuid):
+            label = f" -d {doc}" if doc else ''
+            expected = ConsistencyCheck.summary(EventAggregates.from_file(path, ConsistencyCheck.TASKS, doc), doc_uuid)
+            self.compare(f"parallel -w {self.workers}{label}",
+                         expected, ConsistencyCheck.summary(EventAggregates.from_file_parallel(path, ConsistencyCheck.TASKS, doc, self.workers), doc_uuid))
+
+            DataHandler.use_cache = True
+            for run in ('cold', 'warm'):
+                self.compare(f"{run} cache{label}", expected,
+                             ConsistencyCheck.summary(EventAggregates.from_file(path, ConsistencyCheck.TASKS, doc), doc_uuid))
+            DataHandler.use_cache = False
+
+        # Several ranges per file and several threads, whatever the size of the dataset and the machine
+        CompressedSource.SPLIT_BYTES = 64 << 10
+        CompressedSource.threads = max(CompressedSource.threads, 4)
+        expected = ConsistencyCheck.summary(EventAggregates.from_file(path, ConsistencyCheck.TASKS), doc_uuid)
+        for suffix, compress in (('gz', gzip.compress), ('bz2', bz2.compress)):
+            compressed = os.path.join(workdir, f"events.json.{suffix}")
+            ConsistencyCheck.write_members(path, compressed, compress)
+            self.compare(f"multi-member {suffix}", expected,
+                         ConsistencyCheck.summary(EventAggregates.from_file(compressed, ConsistencyCheck.TASKS), doc_uuid))
+            self.compare(f"multi-member {suffix} -w {self.workers}", expected,
+                         ConsistencyCheck.summary(EventAggregates.from_file_parallel(compressed, ConsistencyCheck.TASKS, workers=self.workers), doc_uuid))
+
+    def check_store(self, path, workdir):
+        """ A store fed the log in two parts must hold the same top-k rows as one fed it at once. """
+        with open(path, 'rb') as handle:
+            lines = handle.readlines()
+        parts = []
+        for number, part in enumerate((lines[:len(lines) // 2], lines[len(lines) // 2:])):
+            parts.append(os.path.join(workdir, f"part{number}.json"))
+            with open(parts[-1], 'wb') as output:
+                output.writelines(part)
+
+        whole, incremental = AlsoLikesStore(os.path.join(workdir, 'whole.db')), AlsoLikesStore(os.path.join(workdir, 'incremental.db'))
+        try:
+            whole.ingest_file(path)
+            for part in parts:
+                incremental.ingest_file(part)
+
+            query = "SELECT doc, rank, other, read_count FROM top_also_likes ORDER BY doc, rank"
+            expected = {'top also likes': whole.connection.execute(query).fetchall()}
+            self.compare('incremental store ingest', expected, {'top also likes': incremental.connection.execute(query).fetchall()})
+        finally:
+            whole.close()
+            incremental.close()
+
+    def run(self):
+        events, visitors, documents = DatasetGenerator.SCALES[self.scale]
+        workdir = tempfile.mkdtemp(prefix='doc-analyzer-check-')
+        cache_dir = DataHandler.CACHE_DIR
+        try:
+            path = os.path.join(workdir, 'events.json')
+            meta = DatasetGenerator(events, visitors, documents).write(path)
+            print(f"Checking {self.scale} dataset ({events} events)")
+
+            DataHandler.CACHE_DIR = os.path.join(workdir, '.cache')
+            self.check_readers(path, meta['doc_uuid'], workdir)
+            self.check_store(path, workdir)
+        finally:
+            DataHandler.CACHE_DIR = cache_dir
+            shutil.rmtree(workdir, ignore_errors=True)
+        return not self.failures
+
+    @staticmethod
+    def parseCLI():
+
+        parser = argparse.ArgumentParser(description="Check that parallel, cached, compressed and incremental reads match the serial scan")
+        parser.add_argument('-s', '--scale', type=str, default='small', choices=DatasetGenerator.SCALES, help='Generated dataset size')
+        parser.add_argument('-w', '--workers', type=int, default=3, help='Processes of the parallel reads')
+        return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = ConsistencyCheck.parseCLI()
+    check = ConsistencyCheck(args.scale, args.workers)
+    if not check.run():
+        print(f"Error: {len(check.failures)} check(s) differ from the serial scan")
+        sys.exit(1)
+    print("All checks match the serial scan")
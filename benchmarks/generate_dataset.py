@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+class DatasetGenerator:
+
+    """ Deterministic Issuu-style event logs with skewed visitor activity and document popularity. """
+
+    # Named sizes used by the benchmark suite: events, visitors, documents
+    SCALES = {
+        'small': (20000, 2000, 500),
+        'medium': (200000, 20000, 5000),
+        'large': (2000000, 150000, 40000),
+    }
+
+    # Event mix of the Issuu sample logs; only pagereadtime events carry event_readtime
+    EVENT_TYPES = {
+        'impression': 0.45,
+        'read': 0.20,
+        'pageread': 0.20,
+        'pagereadtime': 0.12,
+        'click': 0.03,
+    }
+
+    USER_AGENTS = {
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/33.0.1750.146 Safari/537.36': 0.22,
+        'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:27.0) Gecko/20100101 Firefox/27.0': 0.12,
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.74.9 (KHTML, like Gecko) Version/7.0.2 Safari/537.74.9': 0.10,
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/33.0.1750.146 Safari/537.36': 0.08,
+        'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; WOW64; Trident/6.0)': 0.08,
+        'Mozilla/5.0 (Windows NT 6.3; WOW64; Trident/7.0; rv:11.0) like Gecko': 0.07,
+        'Mozilla/4.0 (compatible; MSIE 8.0; Windows NT 5.1; Trident/4.0; .NET CLR 2.0.50727)': 0.04,
+        'Mozilla/5.0 (iPad; CPU OS 7_0_6 like Mac OS X) AppleWebKit/537.51.1 (KHTML, like Gecko) Version/7.0 Mobile/11B651 Safari/9537.53': 0.08,
+        'Mozilla/5.0 (iPhone; CPU iPhone OS 7_1 like Mac OS X) AppleWebKit/537.51.2 (KHTML, like Gecko) Version/7.0 Mobile/11D167 Safari/9537.53': 0.07,
+        'Mozilla/5.0 (Linux; Android 4.4.2; Nexus 5 Build/KOT49H) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/33.0.1750.136 Mobile Safari/537.36': 0.06,
+        'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:27.0) Gecko/20100101 Firefox/27.0': 0.03,
+        'Opera/9.80 (Windows NT 6.1; WOW64) Presto/2.12.388 Version/12.16': 0.02,
+        'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)': 0.03,
+    }
+
+    # A few large audiences and a long tail, including codes that have no continent
+    COUNTRIES = {
+        'US': 0.24, 'GB': 0.08, 'DE': 0.07, 'FR': 0.05, 'IT': 0.05, 'ES': 0.05, 'BR': 0.05, 'MX': 0.04,
+        'CA': 0.04, 'IN': 0.04, 'JP': 0.03, 'AU': 0.03, 'NL': 0.03, 'RU': 0.03, 'TR': 0.02, 'PL': 0.02,
+        'AR': 0.02, 'ZA': 0.02, 'EG': 0.01, 'NG': 0.01, 'CN': 0.01, 'KR': 0.01, 'ID': 0.01, 'NZ': 0.01,
+        'SE': 0.01, 'CH': 0.01, 'PT': 0.01, 'GR': 0.01, 'AP': 0.005, 'EU': 0.005,
+    }
+
+    SOURCES = ['issuu', 'external', 'internal']
+    BLOCK = 100000
+
+    def __init__(self, events, visitors, documents, seed=42, skew=1.1, start_ts=1393631989):
+        self.events = events
+        self.visitors = visitors
+        self.documents = documents
+        self.seed = seed
+        self.skew = skew
+        self.start_ts = start_ts
+
+    @staticmethod
+    def zipf_weights(n, skew):
+        """ Probabilities of ranks 1..n under a Zipf law with the given exponent. """
+        weights = 1.0 / np.arange(1, n + 1) ** skew
+        return weights / weights.sum()
+
+    @staticmethod
+    def distribution(table):
+        """ Keys and normalised probabilities of a {value: weight} table. """
+        keys = list(table)
+        weights = np.array([table[key] for key in keys], dtype=float)
+        return keys, weights / weights.sum()
+
+    def uuids(self, rng):
+        """ Visitor UUIDs, document IDs and each visitor's fixed user agent and country. """
+        visitor_uuids = [f"{value:016x}" for value in rng.integers(0, 1 << 63, self.visitors, dtype=np.int64)]
+        # Issuu document IDs are the upload time (yymmddHHMMSS) followed by a 32 digit hex hash
+        uploaded = self.start_ts - rng.integers(0, 90 * 86400, self.documents)
+        doc_uuids = [f"{time.strftime('%y%m%d%H%M%S', time.gmtime(int(created)))}-{high:016x}{low:016x}"
+                     for created, high, low in zip(uploaded,
+                                                   rng.integers(0, 1 << 63, self.documents, dtype=np.int64),
+                                                   rng.integers(0, 1 << 63, self.documents, dtype=np.int64))]
+
+        agents, agent_p = DatasetGenerator.distribution(DatasetGenerator.USER_AGENTS)
+        countries, country_p = DatasetGenerator.distribution(DatasetGenerator.COUNTRIES)
+        visitor_agent = rng.choice(len(agents), self.visitors, p=agent_p)
+        visitor_country = rng.choice(len(countries), self.visitors, p=country_p)
+        return visitor_uuids, doc_uuids, [agents[i] for i in visitor_agent], [countries[i] for i in visitor_country]
+
+    def iter_events(self):
+        """ Yield the events as dicts, identical for the same parameters and seed. """
+        rng = np.random.default_rng(self.seed)
+        visitor_uuids, doc_uuids, visitor_agents, visitor_countries = self.uuids(rng)
+
+        # Popularity ranks are shuffled so the busiest visitor and document are not simply the first ones
+        visitor_p = DatasetGenerator.zipf_weights(self.visitors, self.skew)[rng.permutation(self.visitors)]
+        doc_p = DatasetGenerator.zipf_weights(self.documents, self.skew)[rng.permutation(self.documents)]
+        event_types, event_p = DatasetGenerator.distribution(DatasetGenerator.EVENT_TYPES)
+
+        ts = self.start_ts
+        for start in range(0, self.events, DatasetGenerator.BLOCK):
+            size = min(DatasetGenerator.BLOCK, self.events - start)
+            visitors = rng.choice(self.visitors, size, p=visitor_p)
+            docs = rng.choice(self.documents, size, p=doc_p)
+            kinds = rng.choice(len(event_types), size, p=event_p)
+            gaps = rng.integers(0, 3, size)
+            readtimes = rng.lognormal(9.5, 1.2, size).astype(np.int64)
+            pages = rng.integers(1, 60, size)
+            sources = rng.integers(0, len(DatasetGenerator.SOURCES), size)
+            ips = rng.integers(0, 1 << 32, size, dtype=np.int64)
+
+            for i in range(size):
+                ts += int(gaps[i])
+                visitor, doc, event_type = visitors[i], doc_uuids[docs[i]], event_types[kinds[i]]
+                event = {
+                    'ts': ts,
+                    'visitor_uuid': visitor_uuids[visitor],
+                    'visitor_source': DatasetGenerator.SOURCES[sources[i]],
+                    'visitor_device': 'browser',
+                    'visitor_useragent': visitor_agents[visitor],
+                    'visitor_ip': f"{ips[i]:08x}",
+                    'visitor_country': visitor_countries[visitor],
+                    'env_type': 'reader',
+                    'env_doc_id': doc,
+                    'event_type': event_type,
+                    'subject_type': 'doc',
+                    'subject_doc_id': doc,
+                }
+                if event_type in ('pageread', 'pagereadtime'):
+                    event['subject_page'] = int(pages[i])
+                if event_type == 'pagereadtime':
+                    event['event_readtime'] = int(readtimes[i])
+                yield event
+
+    def write(self, path):
+        """ Write the log as JSON lines and return the sample UUIDs the benchmarks query. """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        doc_readers = {}
+        with open(path, 'w') as handle:
+            for event in self.iter_events():
+                handle.write(json.dumps(event) + '\n')
+                readers = doc_readers.setdefault(event['subject_doc_id'], set())
+                if len(readers) < 1000:
+                    readers.add(event['visitor_uuid'])
+
+        # A most read document (reader counts are capped at 1000) and one of its readers, for tasks 5d and 6
+        doc_uuid = max(doc_readers, key=lambda doc: (len(doc_readers[doc]), doc))
+        meta = {
+            'events': self.events, 'visitors': self.visitors, 'documents': self.documents,
+            'seed': self.seed, 'skew': self.skew,
+            'doc_uuid': doc_uuid, 'visitor_uuid': min(doc_readers[doc_uuid]),
+        }
+        with open(f"{path}.meta.json", 'w') as handle:
+            json.dump(meta, handle, indent=2)
+        return meta
+
+    @staticmethod
+    def ensure(path, events, visitors, documents, seed=42, skew=1.1):
+        """ Reuse a generated file when its parameters match, otherwise (re)generate it. """
+        wanted = {'events': events, 'visitors': visitors, 'documents': documents, 'seed': seed, 'skew': skew}
+        try:
+            with open(f"{path}.meta.json") as handle:
+                meta = json.load(handle)
+            if os.path.exists(path) and all(meta.get(key) == value for key, value in wanted.items()):
+                return meta
+        except (OSError, ValueError):
+            pass
+        return DatasetGenerator(events, visitors, documents, seed, skew).write(path)
+
+    @staticmethod
+    def parseCLI():
+
+        parser = argparse.ArgumentParser(description="Generate a synthetic Issuu-style event log")
+        parser.add_argument('-o', '--output', type=str, required=True, help='JSON lines file to write')
+        parser.add_argument('-s', '--scale', type=str, choices=DatasetGenerator.SCALES, help='Preset size; explicit counts below override it')
+        parser.add_argument('--events', type=int, help='Number of events')
+        parser.add_argument('--visitors', type=int, help='Number of distinct visitors')
+        parser.add_argument('--documents', type=int, help='Number of distinct documents')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of visitor activity and document popularity')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed gives a byte-identical file')
+        return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = DatasetGenerator.parseCLI()
+    events, visitors, documents = DatasetGenerator.SCALES[args.scale or 'small']
+    generator = DatasetGenerator(args.events or events, args.visitors or visitors, args.documents or documents,
+                                 args.seed, args.skew)
+    meta = generator.write(args.output)
+    print(f"Wrote {meta['events']} events to {args.output} (doc_uuid {meta['doc_uuid']}, visitor_uuid {meta['visitor_uuid']})")
@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from tabulate import tabulate
+
+from benchmarks.generate_dataset import DatasetGenerator
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(REPO_ROOT, 'benchmarks')
+
+class BenchmarkRunner:
+
+    """ Times each CLI task end to end in its own process and records its peak memory. """
+
+    TASKS = ['2a', '2b', '3a', '3b', '4', '5d', '6']
+    DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+    RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+    def __init__(self, scales, tasks, repeat=3, warm=False, workers=1):
+        self.scales = scales
+        self.tasks = tasks
+        self.repeat = repeat
+        self.warm = warm
+        self.workers = workers
+
+    def command(self, task, path, meta):
+        """ CLI invocation of one task; charts are written as CSV so the image renderer is not timed. """
+        command = [sys.executable, os.path.join(REPO_ROOT, 'main.py'), '-t', task, '-f', path,
+                   '-d', meta['doc_uuid'], '-u', meta['visitor_uuid'], '--format', 'csv', '-w', str(self.workers)]
+        if not self.warm:
+            command.append('--no_cache')
+        return command
+
+    @staticmethod
+    def measure(command, workdir):
+        """ Wall time, peak RSS and exit status of one process. """
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+
+        # The child was reaped by wait4 (which also gives its own rusage), so tell Popen it is done
+        returncode = process.returncode = os.waitstatus_to_exitcode(status)
+        process.stderr.close()
+
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        peak = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        error = stderr.decode(errors='replace').strip().splitlines()[-1:] if returncode else []
+        return seconds, peak / 2 ** 20, returncode, error[0] if error else ''
+
+    def run_task(self, task, path, meta):
+        """ Median time and highest peak memory over the repeats of one task. """
+        workdir = tempfile.mkdtemp(prefix='doc-analyzer-bench-')
+        try:
+            if self.warm:
+                # Untimed run that builds the Parquet and user agent caches the timed runs reuse
+                BenchmarkRunner.measure(self.command(task, path, meta), workdir)
+
+            runs = []
+            for _ in range(self.repeat):
+                if not self.warm:
+                    shutil.rmtree(os.path.join(workdir, '.cache'), ignore_errors=True)
+                runs.append(BenchmarkRunner.measure(self.command(task, path, meta), workdir))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        failed = [run for run in runs if run[2] != 0]
+        return {
+            'seconds': round(statistics.median(run[0] for run in runs), 4),
+            'peak_rss_mb': round(max(run[1] for run in runs), 1),
+            'status': 'ok' if not failed else f"exit {failed[0][2]}: {failed[0][3]}",
+        }
+
+    def run(self):
+        """ Generate (or reuse) the dataset of every scale and benchmark every task on it. """
+        results = []
+        for scale in self.scales:
+            events, visitors, documents = DatasetGenerator.SCALES[scale]
+            path = os.path.join(BenchmarkRunner.DATA_DIR, f"{scale}.json")
+            print(f"Preparing {scale} dataset ({events} events)")
+            meta = DatasetGenerator.ensure(path, events, visitors, documents)
+
+            for task in self.tasks:
+                result = {'scale': scale, 'task': task, **self.run_task(task, path, meta)}
+                print(f"  {scale:>6} task {task:<3} {result['seconds']:8.3f} s {result['peak_rss_mb']:8.1f} MiB  {result['status']}")
+                results.append(result)
+
+        return {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': BenchmarkRunner.git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': self.repeat,
+            'warm': self.warm,
+            'workers': self.workers,
+            'results': results,
+        }
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    @staticmethod
+    def save(report, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Results saved as {path}")
+
+    @staticmethod
+    def compare(report, baseline, threshold=1.10):
+        """ Print current against baseline per scale and task; returns the rows whose time or memory grew past the threshold. """
+        previous = {(row['scale'], row['task']): row for row in baseline['results']}
+        rows, regressions = [], []
+        for row in report['results']:
+            old = previous.get((row['scale'], row['task']))
+            if old is None:
+                rows.append([row['scale'], row['task'], '-', row['seconds'], '-', '-', row['peak_rss_mb'], 'new'])
+                continue
+
+            time_ratio = row['seconds'] / old['seconds'] if old['seconds'] else float('inf')
+            memory_ratio = row['peak_rss_mb'] / old['peak_rss_mb'] if old['peak_rss_mb'] else float('inf')
+            verdict = 'ok'
+            if row['status'] != 'ok':
+                verdict = 'failed'
+            elif time_ratio > threshold or memory_ratio > threshold:
+                verdict = 'regressed'
+                regressions.append(row)
+            elif time_ratio < 1 / threshold:
+                verdict = 'faster'
+            rows.append([row['scale'], row['task'], old['seconds'], row['seconds'], f"{time_ratio:.2f}x",
+                         old['peak_rss_mb'], row['peak_rss_mb'], verdict])
+
+        print(f"Baseline: commit {baseline.get('commit')} from {baseline.get('created')}")
+        print(tabulate(rows, headers=['Scale', 'Task', 'Base (s)', 'Now (s)', 'Time', 'Base (MiB)', 'Now (MiB)', 'Verdict'],
+                       tablefmt='grid'))
+        return regressions
+
+    @staticmethod
+    def parseCLI():
+
+        parser = argparse.ArgumentParser(description="Benchmark the document analyzer tasks on synthetic data")
+        parser.add_argument('-s', '--scales', type=str, default='small,medium', help=f"Comma separated dataset sizes from {', '.join(DatasetGenerator.SCALES)}")
+        parser.add_argument('-t', '--tasks', type=str, default=','.join(BenchmarkRunner.TASKS), help='Comma separated task IDs to benchmark')
+        parser.add_argument('-r', '--repeat', type=int, default=3, help='Timed runs per task; the median time is reported')
+        parser.add_argument('-w', '--workers', type=int, default=1, help='Passed to the CLI as --workers')
+        parser.add_argument('--warm', action='store_true', help='Benchmark against a warm Parquet cache instead of parsing the JSON each run')
+        parser.add_argument('--output', type=str, default=os.path.join(BenchmarkRunner.RESULTS_DIR, 'latest.json'), help='File the results are written to')
+        parser.add_argument('--baseline', type=str, default=os.path.join(BenchmarkRunner.RESULTS_DIR, 'baseline.json'), help='Stored results to compare against')
+        parser.add_argument('--save_baseline', action='store_true', help='Also store these results as the new baseline')
+        parser.add_argument('--threshold', type=float, default=1.10, help='Time or memory ratio above which a task counts as regressed')
+        parser.add_argument('--fail_on_regression', action='store_true', help='Exit with status 1 if any task regressed against the baseline')
+        return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = BenchmarkRunner.parseCLI()
+
+    scales = [scale.strip() for scale in args.scales.split(',') if scale.strip()]
+    unknown = [scale for scale in scales if scale not in DatasetGenerator.SCALES]
+    if unknown:
+        print(f"Error: unknown scale(s): {', '.join(unknown)}")
+        sys.exit(1)
+
+    runner = BenchmarkRunner(scales, [task.strip() for task in args.tasks.split(',') if task.strip()],
+                             args.repeat, args.warm, args.workers)
+    report = runner.run()
+    BenchmarkRunner.save(report, args.output)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as handle:
+            regressions = BenchmarkRunner.compare(report, json.load(handle), args.threshold)
+    if args.save_baseline:
+        BenchmarkRunner.save(report, args.baseline)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
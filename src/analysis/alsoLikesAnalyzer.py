@@ -1,47 +1,247 @@
-from graphviz import Digraph
+import numpy as np
 import pandas as pd
 from tabulate import tabulate
+from .data_handler import DataHandler
+from .profiler import Profiler
 import os
+import hashlib
+import csv
+import json
 
 class AlsoLikesAnalyzer:
 
     def __init__(self, df):
         self.df = df
+        self.index = None
+
+    @staticmethod
+    def encode(series):
+        """ Integer codes and their UUID dictionary for a (possibly categorical) UUID column, in UUID order.
+
+        Codes of the reading pairs depend on where chunk and shard boundaries fell; sorting them makes every
+        tie broken by lower code a tie broken by UUID, whichever way the log was read. """
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uuids = series.cat.codes.to_numpy(np.int64), pd.Index(series.cat.categories.astype(object))
+        else:
+            codes, uuids = pd.factorize(series)
+            codes, uuids = codes.astype(np.int64), pd.Index(uuids.astype(object))
+
+        if not uuids.is_monotonic_increasing:
+            order = uuids.argsort()
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            codes, uuids = np.where(codes >= 0, rank[np.maximum(codes, 0)], -1), uuids[order]
+        return codes, uuids
+
+    @staticmethod
+    def csr(rows, cols, n_rows):
+        """ Compressed sparse rows: neighbours of row i are values[offsets[i]:offsets[i + 1]]. """
+        order = np.argsort(rows, kind='stable')
+        offsets = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=offsets[1:])
+        return offsets, cols[order].astype(np.int32)
+
+    @staticmethod
+    def gather(offsets, values, rows):
+        """ Concatenate the neighbour lists of `rows` without a Python loop. """
+        starts = offsets[rows]
+        lengths = offsets[rows + 1] - starts
+        if lengths.sum() == 0:
+            return values[:0]
+        shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return values[np.arange(lengths.sum()) + shifts]
+
+    def build_index(self):
+        """ Build the doc->readers and reader->docs adjacency once; later queries reuse it. """
+        if self.index is not None:
+            return self.index
+
+        with Profiler.stage('build index') as stage:
+            pairs = self.df[['visitor_uuid', 'subject_doc_id']].dropna()
+            stage.count(len(pairs))
+            visitor_codes, visitor_uuids = AlsoLikesAnalyzer.encode(pairs['visitor_uuid'])
+            doc_codes, doc_uuids = AlsoLikesAnalyzer.encode(pairs['subject_doc_id'])
+
+            # A visitor reading a document several times counts once
+            n_docs = max(len(doc_uuids), 1)
+            unique_pairs = np.unique(visitor_codes * n_docs + doc_codes)
+            visitors, docs = unique_pairs // n_docs, unique_pairs % n_docs
+
+            doc_offsets, doc_readers = AlsoLikesAnalyzer.csr(docs, visitors, len(doc_uuids))
+            visitor_offsets, visitor_docs = AlsoLikesAnalyzer.csr(visitors, docs, len(visitor_uuids))
+
+            self.index = {
+                'visitor_uuids': visitor_uuids,
+                'doc_uuids': doc_uuids,
+                'doc_offsets': doc_offsets,
+                'doc_readers': doc_readers,
+                'visitor_offsets': visitor_offsets,
+                'visitor_docs': visitor_docs,
+            }
+            return self.index
+
+    def readers_of(self, document_uuid):
+        """ Visitor codes of the readers of a document (empty if the document is unknown). """
+        index = self.build_index()
+        position = index['doc_uuids'].get_indexer([document_uuid])[0]
+        if position < 0:
+            return index['doc_readers'][:0]
+        return index['doc_readers'][index['doc_offsets'][position]:index['doc_offsets'][position + 1]]
+
+    def readers_of_code(self, doc_code):
+        """ Visitor codes of the readers of the document with index code `doc_code`. """
+        index = self.build_index()
+        return index['doc_readers'][index['doc_offsets'][doc_code]:index['doc_offsets'][doc_code + 1]]
+
+    def documents_of(self, visitor_uuid):
+        """ Document codes read by a visitor (empty if the visitor is unknown). """
+        index = self.build_index()
+        position = index['visitor_uuids'].get_indexer([visitor_uuid])[0]
+        if position < 0:
+            return index['visitor_docs'][:0]
+        return index['visitor_docs'][index['visitor_offsets'][position]:index['visitor_offsets'][position + 1]]
 
     """ Function 5(a) """
     """ Return unique reader UUIDs for a given document. """
     def get_reader_uuids_for_document(self, document_uuid):
         
-        return self.df[self.df['subject_doc_id'] == document_uuid]['visitor_uuid'].unique()
+        return self.build_index()['visitor_uuids'][self.readers_of(document_uuid)].to_numpy()
 
     """ Function (b) """
     """ Return unique document UUIDs read by a given visitor. """
     def get_document_uuids_read_by_visitor(self, visitor_uuid):
        
-        return self.df[self.df['visitor_uuid'] == visitor_uuid]['subject_doc_id'].unique()
+        return self.build_index()['doc_uuids'][self.documents_of(visitor_uuid)].to_numpy()
+
+    def also_likes_codes(self, document_uuid):
+        """ Document codes co-read with a document and their reader counts, most read first. """
+        index = self.build_index()
+        readers = self.readers_of(document_uuid)
+
+        # Every document read by any reader, counted once per reader
+        liked_docs_list = AlsoLikesAnalyzer.gather(index['visitor_offsets'], index['visitor_docs'], readers)
+        docs, counts = np.unique(liked_docs_list, return_counts=True)
+
+        order = np.argsort(-counts, kind='stable')
+        return docs[order], counts[order]
 
     """ Function (c) """
     """ Calculate documents also liked by the readers of a particular document. """
     def also_likes(self, document_uuid):
         
-        reader_uuids = self.get_reader_uuids_for_document(document_uuid)
-
-        liked_docs_list = []
-        for uuid in reader_uuids:
-
-            docs_read_by_visitor = self.get_document_uuids_read_by_visitor(uuid)
-
-            liked_docs_list.extend(docs_read_by_visitor)
-           
-        liked_docs = pd.Series(liked_docs_list).value_counts()
+        docs, counts = self.also_likes_codes(document_uuid)
+        liked_docs = pd.Series(counts, index=self.build_index()['doc_uuids'][docs], name='count')
         return liked_docs
 
+    @Profiler.timed('also likes')
     def get_top_10_also_likes(self, document_uuid):
         """ Retrieve the top 10 also liked documents. """
-        liked_docs = self.also_likes(document_uuid)[:10]
+        # Only the ten winners are decoded back to UUID strings
+        docs, counts = self.also_likes_codes(document_uuid)
+        liked_docs = pd.Series(counts[:10], index=self.build_index()['doc_uuids'][docs[:10]], name='count')
         return liked_docs
-    
-    def print_top_liked_docs(self, top_liked_docs, document_uuid):
+
+    def reading_matrix(self):
+        """ Sparse visitor x document matrix with a 1 wherever the visitor read the document. """
+        from scipy.sparse import csr_matrix
+
+        index = self.build_index()
+        n_visitors, n_docs = len(index['visitor_uuids']), len(index['doc_uuids'])
+        data = np.ones(len(index['visitor_docs']), dtype=np.int32)
+        return csr_matrix((data, index['visitor_docs'], index['visitor_offsets']), shape=(n_visitors, n_docs))
+
+    @staticmethod
+    def top_k_row(columns, counts, k):
+        """ Positions of the k largest counts, ties broken by lower column as in also_likes. """
+        if len(counts) > k:
+            threshold = np.partition(counts, len(counts) - k)[len(counts) - k]
+            keep = np.flatnonzero(counts >= threshold)
+            columns, counts = columns[keep], counts[keep]
+        order = np.lexsort((columns, -counts))[:k]
+        return columns[order], counts[order]
+
+    def batch_also_likes(self, document_uuids=None, top_k=10, block_size=1024):
+        """ Yield (document_uuid, top-k also liked Series) for many documents using sparse co-read products. """
+        index = self.build_index()
+        reads = self.reading_matrix()
+        reads_by_doc = reads.T.tocsr()
+
+        if document_uuids is None:
+            positions = np.arange(len(index['doc_uuids']))
+        else:
+            document_uuids = list(document_uuids)
+            positions = index['doc_uuids'].get_indexer(document_uuids)
+
+        for start in range(0, len(positions), block_size):
+            block = positions[start:start + block_size]
+            known = block[block >= 0]
+
+            # Row i of the product counts, for every document, the readers it shares with document i
+            coreads = (reads_by_doc[known] @ reads).tocsr() if len(known) else None
+
+            row = 0
+            for offset, position in enumerate(block):
+                uuid = document_uuids[start + offset] if document_uuids is not None else index['doc_uuids'][position]
+                if position < 0:
+                    yield uuid, pd.Series(dtype='int64', name='count')
+                    continue
+
+                columns = coreads.indices[coreads.indptr[row]:coreads.indptr[row + 1]]
+                counts = coreads.data[coreads.indptr[row]:coreads.indptr[row + 1]]
+                columns, counts = AlsoLikesAnalyzer.top_k_row(columns, counts, top_k)
+                yield uuid, pd.Series(counts.astype(np.int64), index=index['doc_uuids'][columns], name='count')
+                row += 1
+
+    @staticmethod
+    def read_document_list(doc_list):
+        """ Document UUIDs from a file with one UUID per line, or None when `doc_list` is 'all'. """
+        if doc_list == 'all':
+            return None
+        with open(doc_list) as handle:
+            return [line.strip() for line in handle if line.strip()]
+
+    def save_batch_also_likes(self, output_path, document_uuids=None, top_k=10, results=None):
+        """ Stream batch also-likes results (exact unless `results` yields others) to a CSV or JSON lines file, chosen by extension. """
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        as_jsonl = output_path.endswith(('.jsonl', '.json'))
+
+        written = 0
+        with open(output_path, 'w', newline='') as handle:
+            if not as_jsonl:
+                writer = csv.writer(handle)
+                writer.writerow(['document_uuid', 'rank', 'also_liked_uuid', 'read_count'])
+
+            if results is None:
+                results = self.batch_also_likes(document_uuids, top_k)
+            for document_uuid, liked_docs in Profiler.iterate('batch also likes', results):
+                if as_jsonl:
+                    record = {'document_uuid': document_uuid,
+                              'also_likes': [{'document_uuid': doc, 'read_count': int(count)} for doc, count in liked_docs.items()]}
+                    handle.write(json.dumps(record) + '\n')
+                else:
+                    for rank, (doc, count) in enumerate(liked_docs.items(), start=1):
+                        writer.writerow([document_uuid, rank, doc, int(count)])
+                written += 1
+
+        print(f"Also-likes for {written} documents saved as {output_path}")
+        return written
+
+    def minhash_index(self, bands=32, rows=2):
+        """ MinHash LSH index over this dataset's reader sets, for approximate also-likes lookups. """
+        from .minhash_index import MinHashIndex
+
+        return MinHashIndex(self, bands, rows).build()
+
+    def materialize(self, store_path, top_k=10):
+        """ Write this dataset's reads into a persistent top-k also-likes store and return the store. """
+        from .alsoLikesStore import AlsoLikesStore
+
+        store = AlsoLikesStore(store_path, top_k)
+        store.ingest_pairs(self.df)
+        return store
+
+    @staticmethod
+    def print_top_liked_docs(top_liked_docs, document_uuid):
         """ Print the top liked documents in a tabular format for a specific document. """
         print(f"\nDocuments also liked by readers of doc id: {document_uuid}\n")
         
@@ -57,11 +257,15 @@ class AlsoLikesAnalyzer:
         table = tabulate(top_liked_docs_df, headers='keys', tablefmt='grid', showindex=True)
         print(table)
 
+    @Profiler.timed('build graph')
     def create_also_likes_graph(self, document_uuid, visitor_uuid, top_liked_docs):
         """ Create a graph visualization for the top also liked documents. """
+        from graphviz import Digraph
+
         graph = Digraph('Top10AlsoLikes', format='png')
         graph.attr(rankdir='LR')
-        reader_uuids = self.get_reader_uuids_for_document(document_uuid)
+        visitor_uuids = self.build_index()['visitor_uuids']
+        reader_codes = self.readers_of(document_uuid)
  
         doc_list = top_liked_docs.index.tolist()
  
@@ -71,18 +275,60 @@ class AlsoLikesAnalyzer:
             doc_color = 'green' if doc_uuid == document_uuid else 'lightblue'
             graph.node(doc_uuid, label=label, shape='box', style='filled', color=doc_color)
            
-            users = self.get_reader_uuids_for_document(doc_uuid)
-            for user in users:
-                if user in reader_uuids:
-                    user_color = 'green' if user == visitor_uuid else 'lightpink'
-                    edge_color = 'green' if user == visitor_uuid else 'black'
-                    labelv = user[-4:]
-                    graph.node(user, label=labelv, shape='ellipse', style='filled', color=user_color)
-                    graph.edge(user, doc_uuid, label='Likes', color=edge_color)
+            # Reader lists are sorted unique codes, so shared readers come from one merge instead of a search per user
+            shared_readers = np.intersect1d(self.readers_of(doc_uuid), reader_codes, assume_unique=True)
+            for user in visitor_uuids[shared_readers]:
+                user_color = 'green' if user == visitor_uuid else 'lightpink'
+                edge_color = 'green' if user == visitor_uuid else 'black'
+                labelv = user[-4:]
+                graph.node(user, label=labelv, shape='ellipse', style='filled', color=user_color)
+                graph.edge(user, doc_uuid, label='Likes', color=edge_color)
        
         return graph
+
+    # Rendered graphs kept in the graph cache; the least recently used ones are deleted beyond this
+    GRAPH_CACHE_FILES = 256
+
+    @staticmethod
+    @Profiler.timed('render graph')
+    def render_graph(graph, format='png', cache_dir=None):
+        """ Render a graph with Graphviz, reusing an earlier rendering of the same DOT source. """
+        cache_dir = cache_dir or os.path.join(DataHandler.CACHE_DIR, 'graphs')
+        key = hashlib.sha1(graph.source.encode('utf-8')).hexdigest()
+        cached = os.path.join(cache_dir, f"{key}.{format}")
+
+        if os.path.exists(cached):
+            # A hit refreshes the mtime that pruning orders by
+            os.utime(cached)
+            with open(cached, 'rb') as handle:
+                return handle.read()
+
+        rendered = graph.pipe(format=format)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cached, 'wb') as handle:
+            handle.write(rendered)
+        AlsoLikesAnalyzer.prune_graph_cache(cache_dir)
+        return rendered
+
+    @staticmethod
+    def prune_graph_cache(cache_dir):
+        """ Delete the least recently used renderings beyond GRAPH_CACHE_FILES. """
+        renderings = []
+        for entry in os.scandir(cache_dir):
+            try:
+                renderings.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                # Another process pruned it first
+                continue
+        renderings.sort()
+        for _, path in renderings[:max(len(renderings) - AlsoLikesAnalyzer.GRAPH_CACHE_FILES, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
     
-    def save_graph(self, graph, document_uuid, output_dir='output'):
+    @staticmethod
+    def save_graph(graph, document_uuid, output_dir='output'):
         """ Save the graph to a file in the specified output directory. """
         # Create the output directory if it does not exist
         os.makedirs(output_dir, exist_ok=True)
@@ -90,6 +336,7 @@ class AlsoLikesAnalyzer:
         # Specify the filename for the graph
         filename = os.path.join(output_dir, f"also_likes_graph_{document_uuid}.png")
 
-        # Render and save the graph
-        graph.render(filename=filename, format='png', cleanup=True)
+        # Render (or reuse a cached rendering) and save the graph under the name graph.render would use
+        with open(f"{filename}.png", 'wb') as handle:
+            handle.write(AlsoLikesAnalyzer.render_graph(graph, 'png'))
         print(f"Graph saved as {filename}")
\ No newline at end of file
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import pandas as pd
+from .data_handler import DataHandler
+from .alsoLikesAnalyzer import AlsoLikesAnalyzer
+from .event_aggregates import EventAggregates
+from .profiler import Profiler
+
+class AlsoLikesStore:
+
+    """ Persistent top-k also-likes table that is refreshed only for documents touched by new reads. """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reads (
+            visitor TEXT NOT NULL,
+            doc TEXT NOT NULL,
+            PRIMARY KEY (visitor, doc)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS reads_by_doc ON reads (doc, visitor);
+        CREATE TABLE IF NOT EXISTS top_also_likes (
+            doc TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            other TEXT NOT NULL,
+            read_count INTEGER NOT NULL,
+            PRIMARY KEY (doc, rank)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS ingested_files (
+            fingerprint TEXT PRIMARY KEY,
+            path TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path, top_k=10):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(AlsoLikesStore.SCHEMA)
+
+        # The table is materialised for one k; a store created with a different k keeps its own
+        stored = self.connection.execute("SELECT value FROM settings WHERE key = 'top_k'").fetchone()
+        if stored is None:
+            with self.connection:
+                self.connection.execute("INSERT INTO settings VALUES ('top_k', ?)", (str(top_k),))
+            self.top_k = top_k
+        else:
+            self.top_k = int(stored[0])
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, document_uuid):
+        """ Precomputed top-k also liked documents, in the Series format of get_top_10_also_likes. """
+        rows = self.connection.execute(
+            "SELECT other, read_count FROM top_also_likes WHERE doc = ? ORDER BY rank", (document_uuid,)).fetchall()
+        return pd.Series([count for _, count in rows], index=[other for other, _ in rows], dtype='int64', name='count')
+
+    @Profiler.timed('store ingest')
+    def ingest_file(self, file_name):
+        """ Add the reads of an event file unless this version of it was ingested before. """
+        fingerprint = DataHandler.file_fingerprint(file_name)
+        seen = self.connection.execute("SELECT 1 FROM ingested_files WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if seen:
+            return 0
+
+        aggregates = EventAggregates(['5d'])
+        for chunk in DataHandler.iter_chunks(file_name, EventAggregates.columns_for(['5d'])):
+            aggregates.update(chunk)
+        refreshed = self.ingest_pairs(aggregates.reading_pairs())
+
+        with self.connection:
+            self.connection.execute("INSERT INTO ingested_files VALUES (?, ?)", (fingerprint, os.path.abspath(file_name)))
+        return refreshed
+
+    def ingest_pairs(self, pairs):
+        """ Record new (visitor_uuid, subject_doc_id) reads and refresh the documents whose counts changed. """
+        pairs = pairs[['visitor_uuid', 'subject_doc_id']].dropna().astype(object).drop_duplicates()
+
+        with self.connection:
+            cursor = self.connection.cursor()
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS incoming (visitor TEXT, doc TEXT)")
+            cursor.execute("DELETE FROM incoming")
+            cursor.executemany("INSERT INTO incoming VALUES (?, ?)", pairs.itertuples(index=False, name=None))
+
+            # Only reads not stored yet change any co-read count
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS fresh (visitor TEXT, doc TEXT)")
+            cursor.execute("DELETE FROM fresh")
+            cursor.execute("""
+                INSERT INTO fresh SELECT DISTINCT i.visitor, i.doc FROM incoming i
+                WHERE NOT EXISTS (SELECT 1 FROM reads r WHERE r.visitor = i.visitor AND r.doc = i.doc)
+            """)
+            cursor.execute("INSERT INTO reads SELECT visitor, doc FROM fresh")
+
+            # A new read by v of d changes the counts of d and of every document v has read
+            affected = [row[0] for row in cursor.execute("""
+                SELECT DISTINCT doc FROM reads WHERE visitor IN (SELECT visitor FROM fresh)
+            """)]
+
+        self.refresh(affected)
+        return len(affected)
+
+    @Profiler.timed('store refresh')
+    def refresh(self, document_uuids):
+        """ Recompute the top-k rows of the given documents from their reader neighbourhood only. """
+        if not document_uuids:
+            return
+
+        with self.connection:
+            cursor = self.connection.cursor()
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS affected (doc TEXT PRIMARY KEY)")
+            cursor.execute("DELETE FROM affected")
+            cursor.executemany("INSERT INTO affected VALUES (?)", ((doc,) for doc in document_uuids))
+
+            neighbourhood = pd.read_sql_query("""
+                SELECT visitor AS visitor_uuid, doc AS subject_doc_id FROM reads
+                WHERE visitor IN (SELECT r.visitor FROM reads r JOIN affected a ON r.doc = a.doc)
+            """, self.connection)
+
+            # Sorted categories make ties break by document UUID, independent of ingestion order
+            analytics = AlsoLikesAnalyzer(neighbourhood.astype('category'))
+
+            cursor.execute("DELETE FROM top_also_likes WHERE doc IN (SELECT doc FROM affected)")
+            for document_uuid, liked_docs in analytics.batch_also_likes(document_uuids, self.top_k):
+                cursor.executemany("INSERT INTO top_also_likes VALUES (?, ?, ?, ?)", (
+                    (document_uuid, rank, other, int(count))
+                    for rank, (other, count) in enumerate(liked_docs.items(), start=1)))
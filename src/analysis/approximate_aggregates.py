@@ -0,0 +1,136 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from tabulate import tabulate
+
+from .data_handler import DataHandler
+from .sketches import SpaceSaving, HyperLogLog
+from .profiler import Profiler
+
+class ApproximateAggregates:
+
+    """ Fixed-memory stand-in for EventAggregates: heavy hitters and distinct readers from sketches, with error bounds. """
+
+    # Tasks answered from sketches; also-likes needs the full reading pairs
+    TASKS = ('2a', '2b', '3a', '3b', '4')
+
+    def __init__(self, tasks, epsilon=0.001, doc_uuid=None):
+        self.tasks = list(tasks)
+        self.epsilon = epsilon
+        self.doc_uuid = doc_uuid
+        self.country = SpaceSaving.for_error(epsilon)
+        self.useragent = SpaceSaving.for_error(epsilon)
+        self.read_time = SpaceSaving.for_error(epsilon)
+
+        # Distinct readers of the filtered document, or distinct visitors of the whole log
+        self.readers = HyperLogLog.for_error(epsilon)
+        self.rows = 0
+
+    @staticmethod
+    def columns_for(tasks):
+        columns = ['visitor_uuid']
+        for task in tasks:
+            columns.extend(column for column in DataHandler.TASK_COLUMNS[task] if column not in columns)
+        return columns
+
+    @staticmethod
+    def from_file(file_name, tasks, doc_uuid=None, epsilon=0.001, byte_range=None):
+        """ Stream the file (or one byte range of it) through the sketches; memory does not grow with its length. """
+        aggregates = ApproximateAggregates(tasks, epsilon, doc_uuid)
+        columns = ApproximateAggregates.columns_for(tasks)
+        if byte_range is None:
+            chunks = DataHandler.iter_chunks(file_name, columns, doc_uuid=doc_uuid)
+        else:
+            chunks = DataHandler.iter_json_chunks(file_name, columns, doc_uuid=doc_uuid, byte_range=byte_range)
+
+        for chunk in chunks:
+            with Profiler.stage('sketch chunk') as stage:
+                aggregates.update(chunk)
+                stage.count(len(chunk))
+        return aggregates
+
+    @staticmethod
+    def from_file_parallel(file_name, tasks, doc_uuid=None, epsilon=0.001, workers=2):
+        """ Sketch line-aligned shards in a process pool and merge the sketches, which keeps the same bounds. """
+        shards = DataHandler.shard_ranges(file_name, workers)
+        aggregates = ApproximateAggregates(tasks, epsilon, doc_uuid)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for partial in pool.map(ApproximateAggregates.from_file, repeat(file_name), repeat(tasks), repeat(doc_uuid),
+                                    repeat(epsilon), shards):
+                aggregates.merge(partial)
+        return aggregates
+
+    def update(self, chunk):
+        """ Fold one chunk into every needed sketch; each sketch sees the chunk's exact counts, not its rows. """
+        self.rows += len(chunk)
+        self.readers.update(chunk['visitor_uuid'])
+
+        if {'2a', '2b'} & set(self.tasks):
+            self.country.update(DataHandler.count_values(chunk['visitor_country']))
+
+        if {'3a', '3b'} & set(self.tasks):
+            self.useragent.update(DataHandler.count_values(chunk['visitor_useragent'].astype(str)))
+
+        if '4' in self.tasks:
+            reads = chunk[chunk['event_type'] == 'pagereadtime']
+            self.read_time.update(reads.groupby('visitor_uuid', observed=True)['event_readtime'].sum())
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.country.merge(other.country)
+        self.useragent.merge(other.useragent)
+        self.read_time.merge(other.read_time)
+        self.readers.merge(other.readers)
+        return self
+
+    @staticmethod
+    def counts(summary, name):
+        """ Estimated counts as the int64 count Series the exact aggregates return. """
+        counts = summary.top().round().astype('int64').rename('count')
+        counts.index.name = name
+        return counts
+
+    def country_counts(self):
+        return ApproximateAggregates.counts(self.country, 'visitor_country')
+
+    def continent_counts(self):
+        from .geoDataAnalyzer import GeoDataAnalyzer
+
+        return GeoDataAnalyzer.continent_counts_from_country_counts(self.country_counts())
+
+    def browser_counts(self, detailed=False, field='browser'):
+        from .browserDataAnalyzer import BrowserDataAnalyzer
+
+        useragents = ApproximateAggregates.counts(self.useragent, 'visitor_useragent')
+        if detailed:
+            return useragents
+        return BrowserDataAnalyzer.browser_counts_from_useragent_counts(useragents, field)
+
+    def top_readers(self, n=10):
+        top_readers = self.read_time.top(n).rename('event_readtime')
+        top_readers.index.name = 'visitor_uuid'
+        return top_readers
+
+    def distinct_readers(self):
+        return self.readers.estimate()
+
+    def bounds(self):
+        """ One row per sketch: what it summarises, its size, and how far its answers can be from the exact ones. """
+        rows = []
+        for tasks, label, summary, unit in ((('2a', '2b'), 'countries', self.country, 'views'),
+                                            (('3a', '3b'), 'user agents', self.useragent, 'views'),
+                                            (('4',), 'reader read time', self.read_time, 'ms')):
+            if set(tasks) & set(self.tasks):
+                error = summary.max_error()
+                rows.append([f"{label} (Space-Saving)", f"{summary.capacity} counters",
+                             'exact' if error == 0 else f"each estimate at most {error:,.0f} {unit} too high "
+                                                        f"({error / max(summary.total, 1):.3%} of {summary.total:,.0f})"])
+
+        readers = f"readers of {self.doc_uuid}" if self.doc_uuid else 'visitors'
+        rows.append([f"distinct {readers} (HyperLogLog)", f"{len(self.readers.registers)} registers",
+                     f"~{self.distinct_readers():,.0f} ± {self.readers.standard_error():.2%} (one standard error)"])
+        return rows
+
+    def print_bounds(self):
+        print(f"\nApproximate results over {self.rows} events (target error {self.epsilon:g}):\n")
+        print(tabulate(self.bounds(), headers=['Sketch', 'Size', 'Error bound'], tablefmt='grid'))
@@ -1,19 +1,58 @@
-from user_agents import parse
-import plotly.express as px
-import plotly.io as pio
+import os
+import numpy as np
+import pandas as pd
+from .data_handler import DataHandler
+from .chart_exporter import ChartExporter
+from .user_agent_cache import UserAgentCache
+from .profiler import Profiler
 
 class BrowserDataAnalyzer:
 
-    def process_browser_data(df, detailed = False):
+    # Shared across calls and runs, so every distinct user agent is parsed once
+    ua_cache = None
+
+    def user_agent_cache():
+        if BrowserDataAnalyzer.ua_cache is None:
+            BrowserDataAnalyzer.ua_cache = UserAgentCache(os.path.join(DataHandler.CACHE_DIR, 'user_agents.json'))
+        return BrowserDataAnalyzer.ua_cache
+
+    def user_agent_families(useragents, field='browser'):
+        """ Map a user agent column to browser, os or device family, parsing each distinct value once. """
+        codes, uniques = pd.factorize(useragents)
+        with Profiler.stage('parse user agents') as stage:
+            cache = BrowserDataAnalyzer.user_agent_cache()
+            families = np.array(cache.families(uniques, field) + ['Unknown'], dtype=object)
+            cache.save()
+            stage.count(len(uniques))
+
+        # Missing user agents have code -1, which picks the trailing 'Unknown'
+        return pd.Series(families[codes], index=useragents.index)
+
+    def process_browser_data(df, detailed = False, field = 'browser'):
 
         if detailed:
             df['browser'] = df['visitor_useragent'].astype(str)
         else:
-            df['browser'] = df['visitor_useragent'].apply(lambda ua: parse(ua).browser.family if ua else "Unknown")
-        return df['browser'].value_counts()
+            df['browser'] = BrowserDataAnalyzer.user_agent_families(df['visitor_useragent'], field)
+        return DataHandler.count_values(df['browser'])
+
+    def browser_counts_from_useragent_counts(useragent_counts, field = 'browser'):
+        """ Roll per-user-agent counts up to browser (or os/device) families. """
+        families = BrowserDataAnalyzer.user_agent_families(useragent_counts.index.to_series(), field)
+        return DataHandler.combine_counts([useragent_counts.groupby(families.to_numpy()).sum()])
+
+    def process_browser_data_from_chunks(chunks, detailed = False):
+        """ Browser counts over a stream of DataFrame chunks. """
+        return DataHandler.combine_counts(BrowserDataAnalyzer.process_browser_data(chunk, detailed) for chunk in chunks)
+
+    def process_browser_data_between(index, since=None, until=None, detailed = False):
+        """ Browser counts of the events in [since, until), combined from the buckets of a TimeBucketIndex. """
+        return index.window(since, until).browser_counts(detailed)
     
     def create_analysis_by_main_browser(browser_data):
 
+        import plotly.express as px
+
         # Create the bar chart
         fig = px.bar(browser_data, 
                      x=browser_data.index, 
@@ -42,6 +81,8 @@ class BrowserDataAnalyzer:
 
     def create_bar_chart_browser(data, title, detailed=False):
 
+        import plotly.express as px
+
         # showlabel= False if detailed else True
         showlabel = True
         fig = px.bar(data, x=data.index, y=data.values, title=title,
@@ -64,8 +105,7 @@ class BrowserDataAnalyzer:
         fig.update_traces(hovertemplate=f"<b>%{data.index}</b><br>counts: %{{y}}")
         return fig
     
-    def saveAnalysisByBrowser(browser_counts, file_name, output_folder="output",detailed=False):
-        fig = BrowserDataAnalyzer.create_bar_chart_browser(browser_counts,"Views by Browser",detailed)
-        filename = f"{output_folder}/{file_name}.png"
-        pio.write_image(fig, filename)
-        print(f"Browser distribution plot saved as {filename}")
\ No newline at end of file
+    def saveAnalysisByBrowser(browser_counts, file_name, output_folder="output",detailed=False, exporter=None):
+        return ChartExporter.save(file_name, browser_counts,
+                                  lambda: BrowserDataAnalyzer.create_bar_chart_browser(browser_counts,"Views by Browser",detailed),
+                                  "Browser distribution plot", output_folder, exporter)
\ No newline at end of file
@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .profiler import Profiler
+
+class ChartExporter:
+
+    """ Collects charts and writes them in one batch, sharing a single static-image renderer session. """
+
+    # png/svg/pdf need the static-image renderer; html and csv are written without it
+    FORMATS = ('png', 'svg', 'pdf', 'html', 'csv')
+    STATIC_FORMATS = ('png', 'svg', 'pdf')
+
+    def __init__(self, output_folder="output", format="png", workers=4):
+        if format not in ChartExporter.FORMATS:
+            raise ValueError(f"Unsupported export format '{format}', expected one of {', '.join(ChartExporter.FORMATS)}")
+        self.output_folder = output_folder
+        self.format = format
+        self.workers = workers
+        self.jobs = []
+
+    def add(self, name, data, make_figure, message):
+        """ Queue one chart; `make_figure` is only called when the format needs a figure. """
+        self.jobs.append((name, data, make_figure, message))
+        return os.path.join(self.output_folder, f"{name}.{self.format}")
+
+    @Profiler.timed('export charts')
+    def export(self):
+        """ Write every queued chart and report where each one went. """
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            return []
+
+        os.makedirs(self.output_folder, exist_ok=True)
+        filenames = [f"{self.output_folder}/{name}.{self.format}" for name, _, _, _ in jobs]
+
+        if self.format == 'csv':
+            # The raw series behind the chart, no figure is built at all
+            for (_, data, _, _), filename in zip(jobs, filenames):
+                data.to_csv(filename, header=['count'], index_label=data.index.name or 'label')
+        else:
+            with Profiler.stage('build figures'):
+                figures = [make_figure() for _, _, make_figure, _ in jobs]
+            if self.format == 'html':
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    list(pool.map(lambda job: job[0].write_html(job[1], include_plotlyjs=True), zip(figures, filenames)))
+            else:
+                ChartExporter.write_static(figures, filenames, self.format, self.workers)
+
+        for (_, _, _, message), filename in zip(jobs, filenames):
+            print(f"{message} saved as {filename}")
+        return filenames
+
+    @staticmethod
+    def write_static(figures, filenames, format, workers):
+        """ Render static images, in one renderer session where plotly supports it. """
+        import plotly.io as pio
+
+        if hasattr(pio, 'write_images'):
+            pio.write_images(figures, filenames, format=format)
+            return
+
+        # Older plotly: one write_image per figure, run concurrently
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda job: pio.write_image(job[0], job[1], format=format), zip(figures, filenames)))
+
+    @staticmethod
+    def save(name, data, make_figure, message, output_folder="output", exporter=None):
+        """ Queue on a shared exporter if one is given, otherwise export this chart right away as PNG. """
+        if exporter is not None:
+            return exporter.add(name, data, make_figure, message)
+
+        single = ChartExporter(output_folder)
+        single.add(name, data, make_figure, message)
+        return single.export()[0]
@@ -0,0 +1,278 @@
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+import queue
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+class CompressedSource:
+
+    """ Reads gzip, bz2, xz and zstd event logs as a stream of JSON lines, without a decompressed copy on disk.
+
+    Files made of several independent members (concatenated or multi-member gzip, pbzip2 output, multi-frame
+    zstd) are split on member boundaries and decompressed on several cores. """
+
+    # Leading bytes of each format
+    MAGIC = {
+        'gzip': b'\x1f\x8b',
+        'bz2': b'BZh',
+        'xz': b'\xfd7zXZ\x00',
+        'zstd': b'\x28\xb5\x2f\xfd',
+    }
+
+    # File name endings offered to the Streamlit uploader next to .json
+    EXTENSIONS = ['gz', 'bz2', 'xz', 'zst']
+
+    # Formats whose members can be found and decompressed independently
+    SPLITTABLE = ('gzip', 'bz2', 'zstd')
+
+    # Compressed bytes handed to one thread at a time, and fed to a decompressor per call
+    SPLIT_BYTES = 8 << 20
+    READ_BYTES = 256 << 10
+
+    # Decompressed blocks a thread may run ahead of the reader; with `threads` ranges in flight this bounds memory
+    # to about threads * (QUEUED_BLOCKS + 1) * READ_BYTES * compression ratio
+    QUEUED_BLOCKS = 2
+
+    # Threads decompressing members; zlib, bz2 and zstd release the GIL while they work
+    threads = min(8, os.cpu_count() or 1)
+
+    @staticmethod
+    def detect(source):
+        """ 'gzip', 'bz2', 'xz' or 'zstd' from the first bytes of a path or an open binary file, or None for plain text. """
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as handle:
+                head = handle.read(6)
+        elif hasattr(source, 'seek'):
+            source.seek(0)
+            head = source.read(6)
+            source.seek(0)
+        else:
+            return None
+
+        for kind, magic in CompressedSource.MAGIC.items():
+            if head.startswith(magic):
+                return kind
+        return None
+
+    @staticmethod
+    def zstandard():
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Reading .zst logs needs the optional 'zstandard' package (pip install zstandard)") from None
+        return zstandard
+
+    @staticmethod
+    def open_stream(handle, kind):
+        """ Decompressing binary file object over an open compressed one; iterating it yields lines. """
+        if kind == 'gzip':
+            return gzip.GzipFile(fileobj=handle, mode='rb')
+        if kind == 'bz2':
+            return bz2.BZ2File(handle, mode='rb')
+        if kind == 'xz':
+            return lzma.LZMAFile(handle, mode='rb')
+        reader = CompressedSource.zstandard().ZstdDecompressor().stream_reader(handle, read_across_frames=True, closefd=False)
+        return io.BufferedReader(reader)
+
+    @staticmethod
+    def decompressor(kind):
+        """ Decompressor of exactly one member; what follows the member is left in `unused_data`. """
+        if kind == 'gzip':
+            return zlib.decompressobj(wbits=31)
+        if kind == 'bz2':
+            return bz2.BZ2Decompressor()
+        if kind == 'xz':
+            return lzma.LZMADecompressor()
+        return CompressedSource.zstandard().ZstdDecompressor().decompressobj()
+
+    @staticmethod
+    def next_member(data, kind, position):
+        """ Offset of the first member header at or after `position`, or -1. """
+        if kind == 'bz2':
+            # Stream header 'BZh1'-'BZh9' is always followed by the block magic
+            while True:
+                hit = data.find(b'1AY&SY', position + 4)
+                if hit < 0:
+                    return -1
+                if data[hit - 4:hit - 1] == b'BZh' and data[hit - 1:hit] in b'123456789':
+                    return hit - 4
+                position = hit - 3
+
+        magic = CompressedSource.MAGIC[kind] + (b'\x08' if kind == 'gzip' else b'')
+        return data.find(magic, position)
+
+    @staticmethod
+    def is_member_start(data, kind, offset):
+        """ Whether a header found by byte search really starts a member: it must decode without error. """
+        if kind == 'gzip' and data[offset + 3] & 0xE0:
+            # Reserved flag bits are always zero in a real header
+            return False
+        try:
+            CompressedSource.decompressor(kind).decompress(data[offset:offset + (64 << 10)])
+        except (zlib.error, OSError, EOFError, ValueError):
+            return False
+        except Exception as error:
+            # zstandard raises its own ZstdError
+            if type(error).__name__ == 'ZstdError':
+                return False
+            raise
+        return True
+
+    @staticmethod
+    def split_ranges(file_name, kind, parts):
+        """ Up to `parts` byte ranges of the compressed file that begin and end on member boundaries. """
+        size = os.path.getsize(file_name)
+        if kind not in CompressedSource.SPLITTABLE or parts <= 1 or size == 0:
+            return [(0, size)]
+
+        bounds = [0]
+        with open(file_name, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for part in range(1, parts):
+                position = max(size * part // parts, bounds[-1] + 1)
+                while True:
+                    start = CompressedSource.next_member(data, kind, position)
+                    if start < 0 or CompressedSource.is_member_start(data, kind, start):
+                        break
+                    position = start + 1
+                if start < 0:
+                    break
+                if start > bounds[-1]:
+                    bounds.append(start)
+        bounds.append(size)
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    @staticmethod
+    def inflate(data, kind, position):
+        """ Yield (output, input position, member finished) while decompressing the members from `position` on. """
+        magic = CompressedSource.MAGIC[kind]
+        while position < len(data) and data[position:position + len(magic)] == magic:
+            decompressor = CompressedSource.decompressor(kind)
+            while not decompressor.eof:
+                piece = data[position:position + CompressedSource.READ_BYTES]
+                if not piece:
+                    raise EOFError(f"compressed input ends inside a {kind} member")
+                output = decompressor.decompress(piece)
+                position += len(piece) - len(decompressor.unused_data)
+                yield output, position, decompressor.eof
+
+    @staticmethod
+    def range_blocks(data, kind, start, end):
+        """ Decompressed bytes of the lines that start inside the members in [start, end).
+
+        A range after the first drops everything up to its first newline, and every range reads on past its
+        end up to the next newline, so each line is produced by exactly one range. """
+        skipping = start > 0
+        members = CompressedSource.inflate(data, kind, start)
+        for output, position, finished in members:
+            if position > end or (position == end and not finished):
+                raise ValueError(f"{kind} member boundary expected at byte {end}")
+            if skipping:
+                newline = output.find(b'\n')
+                if newline >= 0:
+                    output, skipping = output[newline + 1:], False
+                else:
+                    output = b''
+            if output:
+                yield output
+            if position == end:
+                break
+
+        if skipping:
+            # The range held no line start at all; the previous range reads this line
+            return
+        for output, _, _ in members:
+            newline = output.find(b'\n')
+            if newline >= 0:
+                yield output[:newline + 1]
+                return
+            yield output
+
+    @staticmethod
+    def produce(file_name, kind, byte_range, blocks, stop):
+        """ Decompress one range into a bounded queue, then put None (or the error raised); gives up once `stop` is set. """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            with open(file_name, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for block in CompressedSource.range_blocks(data, kind, *byte_range):
+                    if not put(block):
+                        return
+        except Exception as error:
+            put(error)
+            return
+        put(None)
+
+    @staticmethod
+    def drain(blocks):
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise block
+            yield block
+
+    @staticmethod
+    def lines_of(blocks):
+        """ Split a stream of byte blocks into lines (without their newlines, which the JSON parser does not need). """
+        rest = b''
+        for block in blocks:
+            lines = (rest + block).split(b'\n')
+            rest = lines.pop()
+            yield from lines
+        if rest:
+            yield rest
+
+    @staticmethod
+    def iter_lines(file_name, kind, byte_range=None):
+        """ Lines of a compressed log, or of the lines owned by one member-aligned byte range of it. """
+        if byte_range is not None:
+            with open(file_name, 'rb') as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from CompressedSource.lines_of(CompressedSource.range_blocks(data, kind, *byte_range))
+            return
+
+        parts = os.path.getsize(file_name) // CompressedSource.SPLIT_BYTES
+        ranges = CompressedSource.split_ranges(file_name, kind, parts) if CompressedSource.threads > 1 else []
+        if len(ranges) <= 1:
+            with open(file_name, 'rb') as handle, CompressedSource.open_stream(handle, kind) as stream:
+                yield from stream
+            return
+
+        # One range per thread is decompressed ahead into a small queue; ranges are read back in file order, and
+        # since each one holds whole lines they are split into lines on their own
+        stop = threading.Event()
+        ranges = iter(ranges)
+        with ThreadPoolExecutor(max_workers=CompressedSource.threads) as pool:
+            pending = deque()
+
+            def submit(byte_range):
+                blocks = queue.Queue(maxsize=CompressedSource.QUEUED_BLOCKS)
+                pool.submit(CompressedSource.produce, file_name, kind, byte_range, blocks, stop)
+                pending.append(blocks)
+
+            try:
+                for byte_range in islice(ranges, CompressedSource.threads):
+                    submit(byte_range)
+                while pending:
+                    blocks = pending.popleft()
+                    byte_range = next(ranges, None)
+                    if byte_range is not None:
+                        submit(byte_range)
+                    yield from CompressedSource.lines_of(CompressedSource.drain(blocks))
+            finally:
+                # A reader that stops early must not leave threads blocked on full queues
+                stop.set()
@@ -1,15 +1,527 @@
+import glob
+import hashlib
+import json
+import mmap
+import os
+from contextlib import contextmanager
+from itertools import islice
+
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .profiler import Profiler
+from .compressed_source import CompressedSource
 
 class DataHandler:
 
+    # Number of JSON lines decoded per chunk; bounds peak memory of the streaming loader
+    DEFAULT_CHUNKSIZE = 100000
+
+    # Columns each task reads from the event log, everything else is skipped while loading
+    TASK_COLUMNS = {
+        '2a': ['visitor_country'],
+        '2b': ['visitor_country'],
+        '3a': ['visitor_useragent'],
+        '3b': ['visitor_useragent'],
+        '4': ['visitor_uuid', 'event_type', 'event_readtime'],
+        '5d': ['visitor_uuid', 'subject_doc_id'],
+        '5e': ['visitor_uuid', 'subject_doc_id'],
+        '6': ['visitor_uuid', 'subject_doc_id'],
+        '7': ['visitor_uuid', 'subject_doc_id'],
+    }
+
+    # Parsed logs are cached here as Parquet so later runs skip JSON decoding
+    CACHE_DIR = '.cache'
+    use_cache = True
+
+    # Fields of an Issuu event kept in the cache, grouped by their on-disk type
+    CACHE_STRING_COLUMNS = [
+        'visitor_uuid', 'visitor_username', 'visitor_source', 'visitor_device', 'visitor_useragent',
+        'visitor_ip', 'visitor_country', 'visitor_referrer', 'env_type', 'env_doc_id', 'env_adid',
+        'event_type', 'subject_type', 'subject_doc_id',
+    ]
+    CACHE_NUMERIC_COLUMNS = ['ts', 'event_index', 'event_readtime', 'subject_page']
+
+    # Bumped whenever the cache layout changes, so older caches are rebuilt
+    CACHE_VERSION = 2
+
+    # Bytes hashed from the start, middle and end of a file to fingerprint its content
+    FINGERPRINT_BLOCK = 1 << 20
+
+    @staticmethod
+    @contextmanager
+    def open_source(file_name):
+        """ Yield a binary line iterator for a path or an already opened (uploaded) file, decompressing it if needed. """
+        kind = CompressedSource.detect(file_name)
+        if isinstance(file_name, (str, os.PathLike)):
+            with open(file_name, 'rb') as handle:
+                yield CompressedSource.open_stream(handle, kind) if kind else handle
+        else:
+            if hasattr(file_name, 'seek'):
+                file_name.seek(0)
+            yield CompressedSource.open_stream(file_name, kind) if kind else file_name
+
+    @staticmethod
+    def is_string_column(series):
+        """ Whether every non-missing value is a string; nested objects and lists are not hashable categories. """
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.cat.categories
+        return pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty')
+
+    @staticmethod
+    def compact_dtypes(df):
+        """ Store repeated strings (countries, user agents, UUIDs, event types) as categoricals. """
+        for column in df.columns:
+            dtype = df[column].dtype
+            if (dtype == object or pd.api.types.is_string_dtype(dtype)) and DataHandler.is_string_column(df[column]):
+                df[column] = df[column].astype('category')
+        return df
+
     @staticmethod
-    def load_data(file_name):
+    def file_fingerprint(file_name):
+        """ Identify a file by its path, size, mtime and a hash of sampled content blocks. """
+        stat = os.stat(file_name)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{os.path.abspath(file_name)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
 
-        return pd.read_json(file_name, lines=True)
+        block = DataHandler.FINGERPRINT_BLOCK
+        with open(file_name, 'rb') as handle:
+            for offset in sorted({0, max(stat.st_size // 2 - block // 2, 0), max(stat.st_size - block, 0)}):
+                handle.seek(offset)
+                digest.update(handle.read(block))
+        return digest.hexdigest()
+
+    @staticmethod
+    def cache_path(file_name):
+        """ Location of the Parquet cache for the current version of `file_name`. """
+        path_key = hashlib.blake2b(os.path.abspath(file_name).encode(), digest_size=8).hexdigest()
+        fingerprint = DataHandler.file_fingerprint(file_name)
+        return os.path.join(DataHandler.CACHE_DIR, f"{path_key}-v{DataHandler.CACHE_VERSION}{fingerprint}.parquet")
 
     @staticmethod
-    def filter_data(file_name,doc_uuid):
+    def clear_cache():
+        """ Delete every file under CACHE_DIR: parsed logs, time indexes, rendered graphs, user agents and follow offsets. """
+        removed = 0
+        for root, _, files in os.walk(DataHandler.CACHE_DIR):
+            for name in files:
+                os.remove(os.path.join(root, name))
+                removed += 1
+        return removed
+
+    @staticmethod
+    def cache_schema():
+        import pyarrow as pa
+
+        fields = [pa.field(column, pa.dictionary(pa.int32(), pa.string())) for column in DataHandler.CACHE_STRING_COLUMNS]
+        fields += [pa.field(column, pa.float64()) for column in DataHandler.CACHE_NUMERIC_COLUMNS]
+        return pa.schema(fields)
+
+    @staticmethod
+    def chunk_to_table(chunk, schema):
+        """ Convert a parsed chunk to an Arrow table with the fixed cache schema. """
+        import pyarrow as pa
+
+        arrays = []
+        for field in schema:
+            if field.name not in chunk or chunk[field.name].isna().all():
+                arrays.append(pa.nulls(len(chunk), field.type))
+            elif pa.types.is_dictionary(field.type) and not DataHandler.is_string_column(chunk[field.name]):
+                # Nested values do not fit the cache; build_cache marks the column as read from JSON instead
+                arrays.append(pa.nulls(len(chunk), field.type))
+            elif pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(chunk[field.name].astype('category')).cast(field.type))
+            else:
+                arrays.append(pa.array(pd.to_numeric(chunk[field.name], errors='coerce'), type=field.type))
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    @staticmethod
+    def build_cache(file_name, chunksize=DEFAULT_CHUNKSIZE):
+        """ Parse the JSON file once and write it to the Parquet cache, replacing older versions. """
+        import pyarrow.parquet as pq
+
+        target = DataHandler.cache_path(file_name)
+        os.makedirs(DataHandler.CACHE_DIR, exist_ok=True)
 
-        df = pd.read_json(file_name, lines=True)
-        df = df[df['subject_doc_id'] == doc_uuid] if doc_uuid else df
+        schema = DataHandler.cache_schema()
+        observed, uncached, integers = [], set(), None
+        partial = f"{target}.{os.getpid()}.tmp"
+        with pq.ParquetWriter(partial, schema) as writer:
+            for chunk in DataHandler.iter_json_chunks(file_name, chunksize=chunksize):
+                with Profiler.stage('write cache') as stage:
+                    observed.extend(column for column in chunk.columns if column not in observed)
+                    uncached.update(column for column in chunk.columns if column not in schema.names
+                                    or (column in DataHandler.CACHE_STRING_COLUMNS and chunk[column].dtype != 'category'
+                                        and chunk[column].notna().any()))
+                    chunk_integers = {column for column in DataHandler.CACHE_NUMERIC_COLUMNS
+                                      if column in chunk and pd.api.types.is_integer_dtype(chunk[column])}
+                    integers = chunk_integers if integers is None else integers & chunk_integers
+                    writer.write_table(DataHandler.chunk_to_table(chunk, schema))
+                    stage.count(len(chunk))
+
+            # Fields in source order (so full loads return the same columns as a JSON parse), the ones the cache
+            # cannot hold, and the numeric ones the JSON parser reads as int64
+            writer.add_key_value_metadata({
+                'observed_columns': json.dumps(observed),
+                'uncached_columns': json.dumps(sorted(uncached)),
+                'integer_columns': json.dumps(sorted(integers or ())),
+            })
+
+        os.replace(partial, target)
+
+        # Drop caches of earlier versions of the same file
+        for stale in glob.glob(target.rsplit('-', 1)[0] + '-*.parquet'):
+            if stale != target:
+                os.remove(stale)
+        return target
+
+    @staticmethod
+    def cached_file(file_name, columns=None):
+        """ Return the Parquet cache of `file_name` (building it if needed), or None when caching does not apply. """
+        if not DataHandler.use_cache or not isinstance(file_name, (str, os.PathLike)):
+            return None
+        if columns is not None and not set(columns) <= set(DataHandler.CACHE_STRING_COLUMNS + DataHandler.CACHE_NUMERIC_COLUMNS):
+            return None
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return None
+
+        path = DataHandler.cache_path(file_name)
+        if not os.path.exists(path):
+            with Profiler.stage('build cache'):
+                DataHandler.build_cache(file_name)
+
+        # Fields the cache cannot hold (nested objects, unknown names) are only available from the JSON itself
+        uncached = set(DataHandler.cache_metadata(path, 'uncached_columns'))
+        if uncached and (columns is None or uncached & set(columns)):
+            return None
+        return path
+
+    @staticmethod
+    def has_cache(file_name):
+        """ Whether a valid cache of this version of `file_name` already exists. """
+        return DataHandler.use_cache and isinstance(file_name, (str, os.PathLike)) \
+            and os.path.exists(DataHandler.cache_path(file_name))
+
+    @staticmethod
+    def cache_metadata(path, key):
+        """ A JSON list stored in the cache's key-value metadata by build_cache. """
+        import pyarrow.parquet as pq
+
+        metadata = pq.read_metadata(path).metadata or {}
+        return json.loads(metadata.get(key.encode(), b'[]'))
+
+    @staticmethod
+    def cached_columns(path, columns):
+        """ Columns to read from the cache: the requested ones, or every field seen in the source file. """
+        if columns is not None:
+            return list(columns)
+        return DataHandler.cache_metadata(path, 'observed_columns') or None
+
+    @staticmethod
+    def restore_dtypes(path, df):
+        """ Give cached numeric columns back the int64 dtype the JSON parser returns for them. """
+        for column in DataHandler.cache_metadata(path, 'integer_columns'):
+            if column in df and df[column].notna().all():
+                df[column] = df[column].astype('int64')
         return df
+
+    @staticmethod
+    def iter_chunks(file_name, columns=None, doc_uuid=None, chunksize=DEFAULT_CHUNKSIZE):
+        """ Stream the log as DataFrames of at most `chunksize` rows holding only `columns`. """
+        # A cold per-document query is cheaper as a byte scan than as a full parse into the cache
+        if doc_uuid and not DataHandler.has_cache(file_name):
+            yield from DataHandler.iter_json_chunks(file_name, columns, doc_uuid, chunksize)
+            return
+
+        cached = DataHandler.cached_file(file_name, columns)
+        if cached is None:
+            yield from DataHandler.iter_json_chunks(file_name, columns, doc_uuid, chunksize)
+            return
+
+        import pyarrow.parquet as pq
+
+        wanted = DataHandler.cached_columns(cached, columns)
+        if doc_uuid and wanted is not None and 'subject_doc_id' not in wanted:
+            wanted = wanted + ['subject_doc_id']
+
+        # Memory-map the cache and decode one batch at a time
+        batches = pq.ParquetFile(cached, memory_map=True).iter_batches(batch_size=chunksize, columns=wanted)
+        while True:
+            with Profiler.stage('read cache') as stage:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                chunk = DataHandler.restore_dtypes(cached, batch.to_pandas())
+                stage.count(len(chunk))
+                if doc_uuid:
+                    chunk = chunk[chunk['subject_doc_id'] == doc_uuid].reset_index(drop=True)
+                    if columns is not None and 'subject_doc_id' not in columns:
+                        chunk = chunk.drop(columns='subject_doc_id')
+            yield chunk
+
+    @staticmethod
+    def shard_ranges(file_name, shards):
+        """ Split a file into at most `shards` byte ranges whose boundaries fall on line starts (member starts if compressed). """
+        kind = CompressedSource.detect(file_name)
+        if kind:
+            return CompressedSource.split_ranges(file_name, kind, shards)
+
+        size = os.path.getsize(file_name)
+        bounds = [0]
+        with open(file_name, 'rb') as handle:
+            for shard in range(1, shards):
+                position = max(size * shard // shards, bounds[-1])
+                if position <= 0:
+                    continue
+
+                # Move to the first line starting at or after `position`
+                handle.seek(position - 1)
+                handle.readline()
+                bounds.append(min(handle.tell(), size))
+        bounds.append(size)
+        return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    @staticmethod
+    def iter_lines(handle, byte_range=None):
+        """ Lines of an open binary file, limited to those starting inside `byte_range` if given. """
+        if byte_range is None:
+            yield from handle
+            return
+
+        start, end = byte_range
+        handle.seek(start)
+        position = start
+        for line in handle:
+            if position >= end:
+                break
+            position += len(line)
+            yield line
+
+    @staticmethod
+    def iter_candidate_lines(file_name, needle, byte_range=None):
+        """ Memory-map the file and yield only the lines containing `needle`, without decoding the rest. """
+        needle = needle.encode('utf-8')
+        with open(file_name, 'rb') as handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                return
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start, end = byte_range if byte_range is not None else (0, len(data))
+                position = start
+                while True:
+                    hit = data.find(needle, position)
+                    if hit < 0:
+                        break
+
+                    line_start = data.rfind(b'\n', 0, hit) + 1
+                    line_end = data.find(b'\n', hit)
+                    line_end = len(data) if line_end < 0 else line_end + 1
+
+                    # Shards own the lines that start inside their range
+                    if line_start >= end:
+                        break
+                    if line_start >= start:
+                        yield data[line_start:line_end]
+                    position = line_end
+
+    @staticmethod
+    def iter_json_chunks(file_name, columns=None, doc_uuid=None, chunksize=DEFAULT_CHUNKSIZE, byte_range=None):
+        """ Decode the JSON lines file into DataFrames of at most `chunksize` rows holding only `columns`. """
+        wanted = None
+        if columns is not None:
+            wanted = list(columns)
+            if doc_uuid and 'subject_doc_id' not in wanted:
+                wanted.append('subject_doc_id')
+
+        is_path = isinstance(file_name, (str, os.PathLike))
+        kind = CompressedSource.detect(file_name) if is_path else None
+        with DataHandler.open_source(file_name) as handle:
+            if kind:
+                # Decompressed as a stream, on several threads when the file has several members
+                lines = CompressedSource.iter_lines(file_name, kind, byte_range)
+            elif doc_uuid and is_path:
+                # Only lines mentioning the UUID can match; they are decoded and checked below
+                lines = DataHandler.iter_candidate_lines(file_name, doc_uuid, byte_range)
+            else:
+                lines = DataHandler.iter_lines(handle, byte_range)
+
+            if doc_uuid and (kind or not is_path):
+                needle = doc_uuid.encode('utf-8')
+                lines = (line for line in lines if needle in line)
+            while True:
+                with Profiler.stage('parse json') as stage:
+                    batch = list(islice(lines, chunksize))
+                    if not batch:
+                        break
+
+                    records = [json.loads(line) for line in batch if line.strip()]
+                    chunk = pd.DataFrame.from_records(records, columns=wanted)
+                    stage.count(len(chunk))
+
+                    if doc_uuid:
+                        if 'subject_doc_id' in chunk:
+                            chunk = chunk[chunk['subject_doc_id'] == doc_uuid]
+                        else:
+                            chunk = chunk.iloc[0:0]
+                        if columns is not None and 'subject_doc_id' not in columns:
+                            chunk = chunk.drop(columns='subject_doc_id')
+                        chunk = chunk.reset_index(drop=True)
+
+                    chunk = DataHandler.compact_dtypes(chunk)
+                yield chunk
+
+    @staticmethod
+    def records_frame(lines, columns=None):
+        """ DataFrame of a list of JSON lines, with the same dtypes as a parsed chunk. """
+        records = [json.loads(line) for line in lines if line.strip()]
+        return DataHandler.compact_dtypes(pd.DataFrame.from_records(records, columns=columns))
+
+    @staticmethod
+    def read_head(file_name, n=5, columns=None):
+        """ The first n events, decoding nothing past them. """
+        with DataHandler.open_source(file_name) as handle:
+            return DataHandler.records_frame(list(islice((line for line in handle if line.strip()), n)), columns)
+
+    @staticmethod
+    def count_lines(file_name, block_size=1 << 24):
+        """ Number of lines, counted as newlines in raw (decompressed) blocks without decoding any JSON. """
+        lines, last = 0, b'\n'
+        with Profiler.stage('count lines') as stage, DataHandler.open_source(file_name) as handle:
+            while True:
+                block = handle.read(block_size)
+                if not block:
+                    break
+                lines += block.count(b'\n')
+                last = block[-1:]
+            # A last line without a trailing newline still counts
+            lines += last != b'\n'
+            stage.count(lines)
+        return lines
+
+    @staticmethod
+    def reservoir_sample(file_name, size, columns=None, seed=0, batch_size=DEFAULT_CHUNKSIZE):
+        """ A uniform random sample of `size` events and the number of events seen, decoding only the sampled lines.
+
+        Reservoir sampling (Algorithm R) over the raw lines, drawing one batch of positions at a time. """
+        rng = np.random.default_rng(seed)
+        reservoir, seen = [], 0
+        with Profiler.stage('reservoir sample') as stage, DataHandler.open_source(file_name) as handle:
+            lines = (line for line in handle if line.strip())
+            while True:
+                batch = list(islice(lines, batch_size))
+                if not batch:
+                    break
+
+                # Fill the reservoir first, then line t (1-based) replaces a random slot with probability size / t
+                fill = min(max(size - len(reservoir), 0), len(batch))
+                reservoir.extend(batch[:fill])
+                positions = np.arange(seen + fill + 1, seen + len(batch) + 1)
+                slots = rng.integers(0, positions) if len(positions) else positions
+                for offset in np.flatnonzero(slots < size):
+                    reservoir[slots[offset]] = batch[fill + offset]
+                seen += len(batch)
+            stage.count(seen)
+
+        with Profiler.stage('parse json') as stage:
+            sample = DataHandler.records_frame(reservoir, columns)
+            stage.count(len(sample))
+        return sample, seen
+
+    @staticmethod
+    def concat_chunks(chunks, columns=None):
+        """ Concatenate chunks into one frame, merging the per-chunk categories of each column. """
+        chunks = list(chunks)
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+
+        df = pd.concat(chunks, ignore_index=True)
+        for column in df.columns:
+            parts = [chunk[column] for chunk in chunks if column in chunk]
+            if parts and all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts) \
+                    and len(parts) == len(chunks):
+                df[column] = pd.Series(union_categoricals(parts), index=df.index)
+        return df
+
+    @staticmethod
+    def load_data(file_name, columns=None, chunksize=DEFAULT_CHUNKSIZE):
+
+        cached = DataHandler.cached_file(file_name, columns)
+        if cached is not None:
+            with Profiler.stage('read cache') as stage:
+                df = pd.read_parquet(cached, columns=DataHandler.cached_columns(cached, columns), memory_map=True)
+                df = DataHandler.restore_dtypes(cached, df)
+                stage.count(len(df))
+            return df
+
+        return DataHandler.concat_chunks(DataHandler.iter_chunks(file_name, columns, chunksize=chunksize), columns)
+
+    @staticmethod
+    def filter_data(file_name, doc_uuid, columns=None, chunksize=DEFAULT_CHUNKSIZE):
+
+        cached = DataHandler.cached_file(file_name, columns) if DataHandler.has_cache(file_name) else None
+        if cached is not None and doc_uuid:
+            wanted = DataHandler.cached_columns(cached, columns)
+            df = pd.read_parquet(cached, columns=wanted, filters=[('subject_doc_id', '==', doc_uuid)], memory_map=True)
+            return DataHandler.restore_dtypes(cached, df.reset_index(drop=True))
+
+        chunks = DataHandler.iter_chunks(file_name, columns, doc_uuid=doc_uuid, chunksize=chunksize)
+        return DataHandler.concat_chunks(chunks, columns)
+
+    @staticmethod
+    def intern_uuids(chunk, dictionaries):
+        """ Replace UUID columns by dense int32 codes from their UuidDictionary (missing values become -1). """
+        chunk = chunk.copy()
+        for column, dictionary in dictionaries.items():
+            if column in chunk:
+                values = chunk[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    # Look up each category once and translate the chunk's own codes
+                    mapping = np.append(dictionary.encode_unique(values.cat.categories), np.int32(-1))
+                    chunk[column] = mapping[values.cat.codes.to_numpy()]
+                else:
+                    chunk[column] = dictionary.encode(values.to_numpy())
+        return chunk
+
+    @staticmethod
+    def in_window(chunk, since=None, until=None):
+        """ Rows with since <= ts < until (either bound may be None); rows without a timestamp are dropped. """
+        keep = chunk['ts'].notna()
+        if since is not None:
+            keep &= chunk['ts'] >= since
+        if until is not None:
+            keep &= chunk['ts'] < until
+        return chunk[keep]
+
+    @staticmethod
+    def iter_window_chunks(file_name, columns, since=None, until=None, chunksize=DEFAULT_CHUNKSIZE):
+        """ Chunks of the rows with since <= ts < until; a Parquet cache is read with the window pushed down to it. """
+        cached = DataHandler.cached_file(file_name, columns) if DataHandler.has_cache(file_name) else None
+        if cached is None:
+            for chunk in DataHandler.iter_chunks(file_name, columns, chunksize=chunksize):
+                yield DataHandler.in_window(chunk, since, until)
+            return
+
+        filters = [('ts', '>=', since)] if since is not None else []
+        filters += [('ts', '<', until)] if until is not None else []
+        with Profiler.stage('read cache') as stage:
+            df = pd.read_parquet(cached, columns=list(columns), filters=filters or None, memory_map=True)
+            df = DataHandler.in_window(DataHandler.restore_dtypes(cached, df), since, until)
+            stage.count(len(df))
+        yield df
+
+    @staticmethod
+    def count_values(series):
+        """ value_counts that drops the unobserved categories of a categorical column. """
+        counts = series.value_counts()
+        return counts[counts > 0]
+
+    @staticmethod
+    def combine_counts(partials):
+        """ Merge per-chunk count Series into one Series sorted by descending count. """
+        partials = [partial for partial in partials if not partial.empty]
+        if not partials:
+            return pd.Series(dtype='int64')
+
+        combined = pd.concat(partials).groupby(level=0, observed=True).sum()
+        return combined.sort_values(ascending=False, kind='stable')
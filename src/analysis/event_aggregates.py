@@ -0,0 +1,176 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+from .data_handler import DataHandler
+from .viewerDataAnalyzer import ReadTimeAccumulator
+from .uuid_dictionary import UuidDictionary
+from .profiler import Profiler
+
+class EventAggregates:
+
+    # Partial aggregates each task is answered from
+    TASK_AGGREGATES = {
+        '2a': {'country'},
+        '2b': {'country'},
+        '3a': {'useragent'},
+        '3b': {'useragent'},
+        '4': {'read_time'},
+        '5d': {'pairs'},
+        '5e': {'pairs'},
+        '6': {'pairs'},
+        '7': {'pairs'},
+    }
+
+    def __init__(self, tasks):
+        self.needed = set()
+        for task in tasks:
+            self.needed |= EventAggregates.TASK_AGGREGATES[task]
+
+        self.country = pd.Series(dtype='int64')
+        self.useragent = pd.Series(dtype='int64')
+        # Visitor and document UUIDs are interned to int32 codes; strings come back only for output
+        self.visitors = UuidDictionary()
+        self.documents = UuidDictionary()
+        self.read_time = ReadTimeAccumulator(self.visitors)
+        self.pair_keys = []
+
+    @staticmethod
+    def columns_for(tasks):
+        """ Union of the columns the given tasks read, in a stable order. """
+        columns = []
+        for task in tasks:
+            columns.extend(column for column in DataHandler.TASK_COLUMNS[task] if column not in columns)
+        return columns
+
+    @staticmethod
+    def from_file(file_name, tasks, doc_uuid=None, byte_range=None, window=None):
+        """ Build the aggregates of `tasks` in one pass over a file, or over one byte range of it.
+
+        `window` is an optional (since, until) pair of epoch seconds; only events with since <= ts < until are counted. """
+        aggregates = EventAggregates(tasks)
+        columns = EventAggregates.columns_for(tasks)
+        if window and 'ts' not in columns:
+            columns.append('ts')
+
+        # Also-likes needs every reader of every document, so then the document filter is applied in memory
+        filter_in_memory = 'pairs' in aggregates.needed and doc_uuid
+        if filter_in_memory and 'subject_doc_id' not in columns:
+            columns.append('subject_doc_id')
+        read_filter = None if filter_in_memory else doc_uuid
+
+        if byte_range is None:
+            chunks = DataHandler.iter_chunks(file_name, columns, doc_uuid=read_filter)
+        else:
+            chunks = DataHandler.iter_json_chunks(file_name, columns, doc_uuid=read_filter, byte_range=byte_range)
+
+        for chunk in chunks:
+            with Profiler.stage('aggregate chunk') as stage:
+                if window:
+                    chunk = DataHandler.in_window(chunk, *window)
+                aggregates.update(chunk, doc_uuid=doc_uuid if filter_in_memory else None)
+                stage.count(len(chunk))
+        return aggregates
+
+    @staticmethod
+    def from_file_parallel(file_name, tasks, doc_uuid=None, workers=2, window=None):
+        """ Parse line-aligned shards of the file in a process pool and merge the partial aggregates in file order. """
+        shards = DataHandler.shard_ranges(file_name, workers)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = pool.map(EventAggregates.from_file, repeat(file_name), repeat(tasks), repeat(doc_uuid), shards,
+                                repeat(window))
+
+            # Workers are not profiled; waiting for a shard shows up as 'parse shards', folding it in as 'merge'
+            aggregates = EventAggregates(tasks)
+            while True:
+                with Profiler.stage('parse shards'):
+                    partial = next(partials, None)
+                if partial is None:
+                    break
+                with Profiler.stage('merge'):
+                    aggregates.merge(partial)
+        return aggregates
+
+    @staticmethod
+    def pair_key(visitor_codes, doc_codes):
+        """ Pack (visitor code, document code) pairs into one int64 so duplicates drop with np.unique. """
+        return (visitor_codes.astype(np.int64) << 32) | doc_codes.astype(np.int64)
+
+    def add_pair_keys(self, keys):
+        self.pair_keys.append(np.unique(keys))
+        if len(self.pair_keys) > 64:
+            self.pair_keys = [np.unique(np.concatenate(self.pair_keys))]
+
+    def merge(self, other):
+        """ Fold the aggregates of a later part of the file into this one. """
+        self.country = DataHandler.combine_counts([self.country, other.country])
+        self.useragent = DataHandler.combine_counts([self.useragent, other.useragent])
+
+        visitor_mapping = self.visitors.absorb(other.visitors)
+        document_mapping = self.documents.absorb(other.documents)
+        self.read_time.merge(other.read_time, visitor_mapping)
+
+        for keys in other.pair_keys:
+            self.add_pair_keys(EventAggregates.pair_key(visitor_mapping[keys >> 32], document_mapping[keys & 0xFFFFFFFF]))
+        return self
+
+    def update(self, chunk, doc_uuid=None):
+        """ Fold one chunk into every needed aggregate in a single pass. """
+        with Profiler.stage('intern uuids'):
+            chunk = DataHandler.intern_uuids(chunk, {'visitor_uuid': self.visitors, 'subject_doc_id': self.documents})
+
+        # Co-read pairs always cover every document; the other aggregates honour the document filter
+        if 'pairs' in self.needed:
+            with Profiler.stage('reading pairs'):
+                visitor_codes = chunk['visitor_uuid'].to_numpy()
+                doc_codes = chunk['subject_doc_id'].to_numpy()
+                keep = (visitor_codes >= 0) & (doc_codes >= 0)
+                self.add_pair_keys(EventAggregates.pair_key(visitor_codes[keep], doc_codes[keep]))
+
+        if doc_uuid:
+            with Profiler.stage('filter document'):
+                doc_code = self.documents.code_of(doc_uuid)
+                chunk = chunk[chunk['subject_doc_id'] == doc_code] if doc_code >= 0 else chunk.iloc[0:0]
+
+        if 'country' in self.needed:
+            with Profiler.stage('count countries'):
+                self.country = DataHandler.combine_counts([self.country, DataHandler.count_values(chunk['visitor_country'])])
+
+        if 'useragent' in self.needed:
+            with Profiler.stage('count user agents'):
+                self.useragent = DataHandler.combine_counts([self.useragent, DataHandler.count_values(chunk['visitor_useragent'].astype(str))])
+
+        if 'read_time' in self.needed:
+            with Profiler.stage('read time'):
+                self.read_time.add_chunk(chunk)
+        return self
+
+    def country_counts(self):
+        return self.country
+
+    def continent_counts(self):
+        from .geoDataAnalyzer import GeoDataAnalyzer
+
+        return GeoDataAnalyzer.continent_counts_from_country_counts(self.country)
+
+    def browser_counts(self, detailed=False, field='browser'):
+        from .browserDataAnalyzer import BrowserDataAnalyzer
+
+        if detailed:
+            return self.useragent
+        return BrowserDataAnalyzer.browser_counts_from_useragent_counts(self.useragent, field)
+
+    def top_readers(self, n=10):
+        return self.read_time.top(n)
+
+    def reading_pairs(self):
+        """ Unique (visitor_uuid, subject_doc_id) pairs seen so far, as categoricals over the interned codes. """
+        with Profiler.stage('dedupe pairs') as stage:
+            keys = np.unique(np.concatenate(self.pair_keys)) if self.pair_keys else np.array([], dtype=np.int64)
+            self.pair_keys = [keys]
+            stage.count(len(keys))
+
+        return pd.DataFrame({
+            'visitor_uuid': self.visitors.categorical((keys >> 32).astype(np.int32)),
+            'subject_doc_id': self.documents.categorical((keys & 0xFFFFFFFF).astype(np.int32)),
+        })
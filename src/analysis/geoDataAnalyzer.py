@@ -1,12 +1,15 @@
-import plotly.express as px
-import plotly.io as pio
-import pycountry_convert as pc
+import pandas as pd
+from .country_regions import SUB_REGIONS
+from .data_handler import DataHandler
+from .chart_exporter import ChartExporter
 
 class GeoDataAnalyzer:
 
     # Convert country code to continent name
     def country_to_continent(country_code):
 
+        import pycountry_convert as pc
+
         try:
 
             continent_code = pc.country_alpha2_to_continent_code(country_code)
@@ -15,19 +18,80 @@ class GeoDataAnalyzer:
         except KeyError:
             return "Unknown"
 
+    # Country -> continent/region/sub_region table, built once per process
+    lookup_table = None
+
+    @staticmethod
+    def country_lookup_table():
+        """ Precomputed continent, region and sub-region of every known alpha-2 country code. """
+        if GeoDataAnalyzer.lookup_table is None:
+            from pycountry_convert.convert_country_alpha2_to_continent_code import COUNTRY_ALPHA2_TO_CONTINENT_CODE
+
+            countries = list(COUNTRY_ALPHA2_TO_CONTINENT_CODE)
+            table = pd.DataFrame({'continent': [GeoDataAnalyzer.country_to_continent(code) for code in countries]},
+                                 index=pd.Index(countries, name='visitor_country'))
+
+            regions = {code: (region, sub_region)
+                       for region, sub_regions in SUB_REGIONS.items()
+                       for sub_region, codes in sub_regions.items()
+                       for code in codes}
+            table['region'] = [regions.get(code, ('Unknown', 'Unknown'))[0] for code in countries]
+            table['sub_region'] = [regions.get(code, ('Unknown', 'Unknown'))[1] for code in countries]
+            GeoDataAnalyzer.lookup_table = table
+        return GeoDataAnalyzer.lookup_table
+
+    @staticmethod
+    def rollup_country_counts(country_counts, level='continent'):
+        """ Sum per-country counts by 'continent', 'region' or 'sub_region'; unlisted codes become 'Unknown'. """
+        groups = GeoDataAnalyzer.country_lookup_table()[level].reindex(country_counts.index).fillna('Unknown')
+        return DataHandler.combine_counts([country_counts.groupby(groups.to_numpy()).sum()])
+
     @staticmethod
     def get_country_counts(df):
 
-        return df['visitor_country'].value_counts()
+        return DataHandler.count_values(df['visitor_country'])
     
     @staticmethod
     def get_continent_counts(df):
 
-        return df['visitor_country'].apply(GeoDataAnalyzer.country_to_continent).value_counts()
+        # Count countries first so the lookup costs one row per distinct country, not per event
+        return GeoDataAnalyzer.rollup_country_counts(GeoDataAnalyzer.get_country_counts(df), 'continent')
+
+    @staticmethod
+    def get_region_counts(df, level='region'):
+        """ Views per UN region ('region') or sub-region ('sub_region'). """
+        return GeoDataAnalyzer.rollup_country_counts(GeoDataAnalyzer.get_country_counts(df), level)
+
+    @staticmethod
+    def continent_counts_from_country_counts(country_counts):
+        """ Roll per-country counts up to continents. """
+        return GeoDataAnalyzer.rollup_country_counts(country_counts, 'continent')
+
+    @staticmethod
+    def get_country_counts_from_chunks(chunks):
+        """ Country counts over a stream of DataFrame chunks. """
+        return DataHandler.combine_counts(GeoDataAnalyzer.get_country_counts(chunk) for chunk in chunks)
+
+    @staticmethod
+    def get_continent_counts_from_chunks(chunks):
+        """ Continent counts over a stream of DataFrame chunks. """
+        return DataHandler.combine_counts(GeoDataAnalyzer.get_continent_counts(chunk) for chunk in chunks)
+
+    @staticmethod
+    def get_country_counts_between(index, since=None, until=None):
+        """ Country counts of the events in [since, until), combined from the buckets of a TimeBucketIndex. """
+        return index.window(since, until).country_counts()
+
+    @staticmethod
+    def get_continent_counts_between(index, since=None, until=None):
+        """ Continent counts of the events in [since, until), combined from the buckets of a TimeBucketIndex. """
+        return index.window(since, until).continent_counts()
     
     @staticmethod
     def create_analysis_by_country(country_counts):
 
+        import plotly.express as px
+
         # Create the bar chart
         fig = px.bar(country_counts, 
                      x=country_counts.index, 
@@ -58,6 +122,8 @@ class GeoDataAnalyzer:
     @staticmethod
     def create_analysis_by_continent(continent_counts):
 
+        import plotly.express as px
+
         # Create the bar chart
         fig = px.bar(continent_counts, 
                     x=continent_counts.index, 
@@ -86,14 +152,12 @@ class GeoDataAnalyzer:
         return fig
 
     @staticmethod
-    def saveAnalysisByCountry(country_counts, output_folder="output"):
-        fig = GeoDataAnalyzer.create_analysis_by_country(country_counts)
-        filename = f"{output_folder}/country_distribution.png"
-        pio.write_image(fig, filename)
-        print(f"\nCountry distribution plot saved as {filename}")
-
-    def saveAnalysisByContinent(continent_counts, output_folder="output"):
-        fig = GeoDataAnalyzer.create_analysis_by_continent(continent_counts)
-        filename = f"{output_folder}/continent_distribution.png"
-        pio.write_image(fig, filename)
-        print(f"\nContinent distribution plot saved as {filename}")
+    def saveAnalysisByCountry(country_counts, output_folder="output", exporter=None):
+        return ChartExporter.save("country_distribution", country_counts,
+                                  lambda: GeoDataAnalyzer.create_analysis_by_country(country_counts),
+                                  "\nCountry distribution plot", output_folder, exporter)
+
+    def saveAnalysisByContinent(continent_counts, output_folder="output", exporter=None):
+        return ChartExporter.save("continent_distribution", continent_counts,
+                                  lambda: GeoDataAnalyzer.create_analysis_by_continent(continent_counts),
+                                  "\nContinent distribution plot", output_folder, exporter)
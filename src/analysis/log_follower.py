@@ -0,0 +1,96 @@
+import hashlib
+import os
+import pickle
+
+from .data_handler import DataHandler
+from .event_aggregates import EventAggregates
+from .profiler import Profiler
+
+class LogFollower:
+
+    """ Tails an append-only event log, folding only the lines added since the last poll into the aggregates. """
+
+    # Bytes at the start of the file hashed to notice when it was replaced rather than appended to
+    HEAD_BYTES = 4096
+
+    def __init__(self, file_name, tasks, doc_uuid=None, state_path=None):
+        self.file_name = file_name
+        self.tasks = list(tasks)
+        self.doc_uuid = doc_uuid
+        self.state_path = state_path or LogFollower.default_state_path(file_name, tasks, doc_uuid)
+        self.reset()
+        self.load()
+
+    @staticmethod
+    def default_state_path(file_name, tasks, doc_uuid=None):
+        """ One state file per log, task set and document filter, since the aggregates depend on all three. """
+        key = hashlib.blake2b(f"{os.path.abspath(file_name)}|{','.join(sorted(tasks))}|{doc_uuid or ''}".encode(),
+                              digest_size=8).hexdigest()
+        return os.path.join(DataHandler.CACHE_DIR, 'follow', f"{key}.pkl")
+
+    def reset(self):
+        self.offset = 0
+        self.head = None
+        self.aggregates = EventAggregates(self.tasks)
+
+    def load(self):
+        """ Resume from the saved offset and aggregates, if a state file exists. """
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'rb') as handle:
+                state = pickle.load(handle)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # A damaged state file means starting over from the beginning of the log
+            return
+        self.offset, self.head, self.aggregates = state['offset'], state['head'], state['aggregates']
+
+    def save(self):
+        """ Persist offset and aggregates together, so a restart resumes exactly where they left off. """
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        partial = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(partial, 'wb') as handle:
+            pickle.dump({'offset': self.offset, 'head': self.head, 'aggregates': self.aggregates}, handle,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, self.state_path)
+
+    @staticmethod
+    def head_digest(handle, length):
+        handle.seek(0)
+        return hashlib.blake2b(handle.read(min(length, LogFollower.HEAD_BYTES)), digest_size=16).hexdigest()
+
+    def complete_end(self, handle, size):
+        """ Offset just past the last newline at or after the current offset; a partly written line waits for the next poll. """
+        position = size
+        while position > self.offset:
+            start = max(self.offset, position - (1 << 16))
+            handle.seek(start)
+            block = handle.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+        return self.offset
+
+    def poll(self):
+        """ Ingest the complete lines appended since the last poll; returns the aggregates of just those lines, or None. """
+        with open(self.file_name, 'rb') as handle:
+            size = os.fstat(handle.fileno()).st_size
+
+            # A shorter file or a different beginning means the log was truncated or rotated
+            if size < self.offset or (self.head is not None and LogFollower.head_digest(handle, self.offset) != self.head):
+                print(f"{self.file_name} was truncated or replaced, reading it again from the start")
+                self.reset()
+
+            end = self.complete_end(handle, size)
+            if end <= self.offset:
+                return None
+            head = LogFollower.head_digest(handle, end)
+
+        with Profiler.stage('follow'):
+            fresh = EventAggregates.from_file(self.file_name, self.tasks, self.doc_uuid, byte_range=(self.offset, end))
+            # `fresh` is merged with its own dictionaries intact so the caller can still read the new pairs from it
+            self.aggregates.merge(fresh)
+
+        self.offset, self.head = end, head
+        return fresh
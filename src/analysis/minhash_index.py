@@ -0,0 +1,188 @@
+import time
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from .profiler import Profiler
+
+class MinHashIndex:
+
+    """ MinHash signatures of every document's reader set, banded into an LSH index for "documents like X" lookups.
+
+    Candidates are the documents sharing at least one band with X; they are ranked by the co-reader count
+    estimated from their signatures, so a lookup touches the candidates instead of every reader's history. """
+
+    # Mersenne prime of the universal hash family h(x) = (a * x + b) mod PRIME
+    PRIME = (1 << 31) - 1
+
+    # Permutations hashed at once while building signatures, bounding the temporary (pairs x block) array
+    BLOCK = 16
+
+    def __init__(self, analyzer, bands=32, rows=2, popular=256, verify=40, seed=0):
+        self.analyzer = analyzer
+        self.bands = bands
+        self.rows = rows
+        self.popular = popular
+        self.verify = verify
+        self.seed = seed
+        self.signatures = None
+        self.sizes = None
+        self.band_keys = []
+        self.band_order = []
+        self.most_read = None
+
+    def build(self):
+        """ Compute the signatures and the sorted band keys once; later lookups reuse them. """
+        if self.signatures is not None:
+            return self
+
+        index = self.analyzer.build_index()
+        with Profiler.stage('minhash signatures') as stage:
+            self.signatures = MinHashIndex.signatures_of(index['doc_offsets'], index['doc_readers'],
+                                                         len(index['visitor_uuids']), self.bands * self.rows, self.seed)
+            self.sizes = np.diff(index['doc_offsets'])
+            stage.count(len(self.sizes))
+
+        # Co-read counts favour widely read documents even when their Jaccard similarity is low, so the most read
+        # ones are always candidates
+        self.most_read = np.argsort(-self.sizes, kind='stable')[:self.popular]
+
+        with Profiler.stage('lsh bands'):
+            for band in range(self.bands):
+                keys = MinHashIndex.band_key(self.signatures[:, band * self.rows:(band + 1) * self.rows])
+                order = np.argsort(keys, kind='stable').astype(np.int32)
+                self.band_keys.append(keys[order])
+                self.band_order.append(order)
+        return self
+
+    @staticmethod
+    def signatures_of(offsets, readers, n_visitors, permutations, seed=0):
+        """ (documents x permutations) minimum hash of each document's readers; documents without readers get PRIME. """
+        rng = np.random.default_rng(seed)
+        a = rng.integers(1, MinHashIndex.PRIME, size=permutations, dtype=np.int64)
+        b = rng.integers(0, MinHashIndex.PRIME, size=permutations, dtype=np.int64)
+
+        n_docs = len(offsets) - 1
+        signatures = np.full((n_docs, permutations), MinHashIndex.PRIME, dtype=np.uint32)
+        read = np.flatnonzero(np.diff(offsets) > 0)
+        if not len(read):
+            return signatures
+
+        visitors = np.arange(n_visitors, dtype=np.int64)[:, None]
+        for start in range(0, permutations, MinHashIndex.BLOCK):
+            stop = min(start + MinHashIndex.BLOCK, permutations)
+            # Hash every visitor once per permutation, then take the minimum over each document's slice of readers
+            hashes = ((a[start:stop] * visitors + b[start:stop]) % MinHashIndex.PRIME).astype(np.uint32)
+            signatures[read, start:stop] = np.minimum.reduceat(hashes[readers], offsets[read], axis=0)
+        return signatures
+
+    @staticmethod
+    def band_key(columns):
+        """ One 64-bit key per row of a band; equal bands always collide, different ones almost never do. """
+        keys = np.zeros(len(columns), dtype=np.uint64)
+        for column in range(columns.shape[1]):
+            keys = keys * np.uint64(0x9E3779B97F4A7C15) + columns[:, column].astype(np.uint64)
+        return keys
+
+    def candidates(self, position):
+        """ Codes of the most read documents and of those sharing a band with the document at `position` (itself included). """
+        signature = self.signatures[position]
+        found = [self.most_read]
+        for band in range(self.bands):
+            key = MinHashIndex.band_key(signature[None, band * self.rows:(band + 1) * self.rows])[0]
+            keys = self.band_keys[band]
+            found.append(self.band_order[band][np.searchsorted(keys, key, 'left'):np.searchsorted(keys, key, 'right')])
+        return np.unique(np.concatenate(found))
+
+    def also_likes_codes(self, document_uuid):
+        """ Candidate document codes and their estimated co-reader counts, most read first. """
+        self.build()
+        doc_uuids = self.analyzer.build_index()['doc_uuids']
+        position = doc_uuids.get_indexer([document_uuid])[0]
+        if position < 0 or self.sizes[position] == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+        docs = self.candidates(position)
+        # Jaccard J of two reader sets is the share of agreeing minima; shared readers = J * (|A| + |B|) / (1 + J)
+        similarity = (self.signatures[docs] == self.signatures[position]).mean(axis=1)
+        counts = np.rint(similarity * (self.sizes[docs] + self.sizes[position]) / (1 + similarity)).astype(np.int64)
+
+        # Shared readers never exceed the smaller set
+        counts = np.minimum(counts, np.minimum(self.sizes[docs], self.sizes[position]))
+        keep = counts > 0
+        docs, counts = docs[keep], counts[keep]
+        order = np.argsort(-counts, kind='stable')
+        docs, counts = docs[order], counts[order]
+
+        # Estimates are coarse for sets of very different sizes, so the leading candidates are counted exactly
+        if self.verify:
+            head = docs[:self.verify]
+            readers = self.analyzer.readers_of(document_uuid)
+            exact = np.array([len(np.intersect1d(self.analyzer.readers_of_code(doc), readers, assume_unique=True))
+                              for doc in head], dtype=np.int64)
+            order = np.argsort(-exact, kind='stable')
+            docs, counts = np.concatenate([head[order], docs[self.verify:]]), np.concatenate([exact[order], counts[self.verify:]])
+        return docs, counts
+
+    @Profiler.timed('approximate also likes')
+    def top_also_likes(self, document_uuid, k=10):
+        """ The k documents estimated to share the most readers with `document_uuid`, in the shape of get_top_10_also_likes. """
+        docs, counts = self.also_likes_codes(document_uuid)
+        doc_uuids = self.analyzer.build_index()['doc_uuids']
+        return pd.Series(counts[:k], index=doc_uuids[docs[:k]], name='count')
+
+    def batch_also_likes(self, document_uuids=None, top_k=10):
+        """ Yield (document_uuid, top-k Series) like AlsoLikesAnalyzer.batch_also_likes, one LSH lookup per document. """
+        if document_uuids is None:
+            document_uuids = self.analyzer.build_index()['doc_uuids']
+        for document_uuid in document_uuids:
+            yield document_uuid, self.top_also_likes(document_uuid, top_k)
+
+    def recall(self, sample_size=100, k=10):
+        """ Mean recall@k and per-lookup time of the LSH answers against the exact ones, on a seeded sample of documents. """
+        self.build()
+        index = self.analyzer.build_index()
+        read = np.flatnonzero(self.sizes > 0)
+        rng = np.random.default_rng(self.seed)
+        sample = rng.choice(read, size=min(sample_size, len(read)), replace=False)
+
+        recalls, exact_seconds, approximate_seconds = [], 0.0, 0.0
+        for position in sample:
+            document_uuid = index['doc_uuids'][position]
+
+            start = time.perf_counter()
+            docs, counts = self.analyzer.also_likes_codes(document_uuid)
+            exact_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            found, _ = self.also_likes_codes(document_uuid)
+            approximate_seconds += time.perf_counter() - start
+
+            # The document itself heads both lists and would flatter the score; any document tied with the
+            # exact k-th count is an equally correct answer
+            docs, counts = docs[docs != position], counts[docs != position]
+            if len(docs):
+                relevant = set(docs[counts >= counts[min(k, len(docs)) - 1]].tolist())
+                hits = len(relevant & set(found[found != position][:k].tolist()))
+                recalls.append(hits / min(k, len(docs)))
+
+        return {
+            'documents': len(sample),
+            'bands': self.bands,
+            'rows': self.rows,
+            'threshold': (1 / self.bands) ** (1 / self.rows),
+            'recall': float(np.mean(recalls)) if recalls else None,
+            'exact_ms': 1000 * exact_seconds / max(len(sample), 1),
+            'approximate_ms': 1000 * approximate_seconds / max(len(sample), 1),
+        }
+
+    def print_recall(self, sample_size=100, k=10):
+        report = self.recall(sample_size, k)
+        recall = 'n/a' if report['recall'] is None else f"{report['recall']:.1%}"
+        print(f"\nMinHash LSH recall@{k} against the exact also-likes on {report['documents']} sampled documents:\n")
+        print(tabulate([[f"{report['bands']} x {report['rows']}", f"{report['threshold']:.2f}", recall,
+                         f"{report['exact_ms']:.3f}", f"{report['approximate_ms']:.3f}"]],
+                       headers=['Bands x rows', 'Similarity threshold', 'Recall', 'Exact (ms/doc)', 'LSH (ms/doc)'],
+                       tablefmt='grid'))
+        return report
@@ -0,0 +1,193 @@
+import contextvars
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+from tabulate import tabulate
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak resident memory is then not reported
+    resource = None
+
+class Stage:
+
+    """ Handle given to an instrumented block so it can report how many rows it handled. """
+
+    def __init__(self):
+        self.rows = None
+
+    def count(self, rows):
+        self.rows = (self.rows or 0) + int(rows)
+
+
+class Profiler:
+
+    """ Wall time, row counts and peak traced memory per named stage; nested stages are recorded under their parent. """
+
+    # Profiler the stage hooks report to, per thread (each Streamlit session runs in its own); with none active the
+    # hooks cost a context manager and nothing else
+    active = contextvars.ContextVar('active_profiler', default=None)
+
+    # tracemalloc is process-wide, so only one profiler at a time traces memory; concurrent ones record time only
+    memory_lock = threading.Lock()
+    memory_owner = None
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.stack = []
+        self.started_tracing = False
+        self.token = None
+        self.total_seconds = 0.0
+        self.peak_bytes = 0
+
+    def __enter__(self):
+        if self.trace_memory:
+            with Profiler.memory_lock:
+                if Profiler.memory_owner is None:
+                    Profiler.memory_owner = self
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start()
+                        self.started_tracing = True
+                else:
+                    self.trace_memory = False
+        self.token = Profiler.active.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.total_seconds = time.perf_counter() - self.start
+        Profiler.active.reset(self.token)
+        if self.trace_memory:
+            with Profiler.memory_lock:
+                if tracemalloc.is_tracing():
+                    self.peak_bytes = max(self.peak_bytes, tracemalloc.get_traced_memory()[1])
+                if self.started_tracing:
+                    tracemalloc.stop()
+                    self.started_tracing = False
+                Profiler.memory_owner = None
+        return False
+
+    @staticmethod
+    @contextmanager
+    def stage(name):
+        """ Time the enclosed block as stage `name` of the active profiler, if there is one. """
+        profiler = Profiler.active.get()
+        if profiler is None:
+            yield Stage()
+            return
+        with profiler.measure(name) as stage:
+            yield stage
+
+    @staticmethod
+    def iterate(name, iterable):
+        """ Yield from `iterable`, recording the time spent producing each item (not consuming it) as stage `name`. """
+        iterator, done = iter(iterable), object()
+        while True:
+            with Profiler.stage(name) as stage:
+                item = next(iterator, done)
+                if item is done:
+                    break
+                stage.count(1)
+            yield item
+
+    @staticmethod
+    def timed(name):
+        """ Decorator recording every call of a function as stage `name`. """
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with Profiler.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    @contextmanager
+    def measure(self, name):
+        path = (self.stack[-1]['path'] if self.stack else ()) + (name,)
+        record = self.stages.setdefault(path, {'calls': 0, 'seconds': 0.0, 'rows': None, 'peak_bytes': 0})
+
+        # tracemalloc keeps one peak, so it is reset per stage and the enclosing stage's peak is carried in `floor`
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        start_bytes = 0
+        if tracing:
+            start_bytes, peak_so_far = tracemalloc.get_traced_memory()
+            self.raise_floor(peak_so_far)
+            tracemalloc.reset_peak()
+
+        frame = {'path': path, 'floor': 0}
+        self.stack.append(frame)
+        stage = Stage()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            record['calls'] += 1
+            record['seconds'] += time.perf_counter() - start
+            if stage.rows is not None:
+                record['rows'] = (record['rows'] or 0) + stage.rows
+
+            self.stack.pop()
+            if tracing:
+                peak = max(tracemalloc.get_traced_memory()[1], frame['floor'])
+                record['peak_bytes'] = max(record['peak_bytes'], peak - start_bytes)
+                self.raise_floor(peak)
+
+    def raise_floor(self, peak):
+        if self.stack:
+            self.stack[-1]['floor'] = max(self.stack[-1]['floor'], peak)
+        else:
+            self.peak_bytes = max(self.peak_bytes, peak)
+
+    @staticmethod
+    def peak_rss_mb():
+        """ High-water resident memory of this process (ru_maxrss is KiB on Linux, bytes on macOS). """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+    def records(self):
+        """ One dict per stage, parents before their children. """
+        return [{
+            'stage': ' / '.join(path),
+            'depth': len(path) - 1,
+            'calls': record['calls'],
+            'seconds': round(record['seconds'], 4),
+            'rows': record['rows'],
+            'peak_mb': round(record['peak_bytes'] / 2 ** 20, 1) if self.trace_memory else None,
+        } for path, record in self.stages.items()]
+
+    def frame(self):
+        """ The stages as a DataFrame, for display in the Streamlit app. """
+        return pd.DataFrame(self.records(), columns=['stage', 'calls', 'seconds', 'rows', 'peak_mb'])
+
+    def to_json(self):
+        peak_rss = Profiler.peak_rss_mb()
+        return json.dumps({
+            'total_seconds': round(self.total_seconds, 4),
+            'traced_peak_mb': round(self.peak_bytes / 2 ** 20, 1) if self.trace_memory else None,
+            'peak_rss_mb': None if peak_rss is None else round(peak_rss, 1),
+            'stages': self.records(),
+        }, indent=2)
+
+    def table(self):
+        # Nesting is shown with dots since tabulate strips leading spaces
+        rows = [['. ' * record['depth'] + record['stage'].split(' / ')[-1], record['calls'], f"{record['seconds']:.3f}",
+                 '' if record['rows'] is None else record['rows'], '' if record['peak_mb'] is None else record['peak_mb']]
+                for record in self.records()]
+        rows.append(['total', '', f"{self.total_seconds:.3f}", '', round(self.peak_bytes / 2 ** 20, 1) if self.trace_memory else ''])
+        table = tabulate(rows, headers=['Stage', 'Calls', 'Seconds', 'Rows', 'Peak (MiB)'], tablefmt='grid')
+
+        # Peak is memory traced by Python allocators above the stage's starting point; Arrow buffers are not included
+        peak_rss = Profiler.peak_rss_mb()
+        if peak_rss is not None:
+            table += f"\nPeak resident memory of the process: {peak_rss:.1f} MiB"
+        return table
@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+class SpaceSaving:
+
+    """ Heavy hitters of a weighted stream in at most `capacity` counters (Metwally et al.'s Space-Saving).
+
+    Every kept key's estimate is an overestimate by at most its `errors` entry, itself at most total / capacity.
+    Chunks are folded in as exact per-chunk counts with the mergeable form of the algorithm (Agarwal et al.). """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.counts = pd.Series(dtype='float64')
+        self.errors = pd.Series(dtype='float64')
+        self.total = 0.0
+
+    @staticmethod
+    def for_error(epsilon):
+        """ A summary whose estimates are within epsilon * total of the true counts. """
+        return SpaceSaving(math.ceil(1 / epsilon))
+
+    def floor(self):
+        """ What a key outside a full summary may have had; 0 until the summary fills up. """
+        return float(self.counts.min()) if len(self.counts) >= self.capacity else 0.0
+
+    def update(self, counts):
+        """ Fold in the exact counts (or summed weights) of one chunk, a Series indexed by key. """
+        counts = counts[counts > 0].astype('float64')
+        counts.index = pd.Index(counts.index.to_numpy(dtype=object), name=counts.index.name)
+        return self.combine(counts, pd.Series(0.0, index=counts.index), 0.0, float(counts.sum()))
+
+    def merge(self, other):
+        return self.combine(other.counts, other.errors, other.floor(), other.total)
+
+    def combine(self, counts, errors, floor, total):
+        # A key missing from one side is charged that side's floor, so estimates never fall below the true count
+        own_floor = self.floor()
+        keys = self.counts.index.union(counts.index, sort=False)
+        estimates = self.counts.reindex(keys, fill_value=own_floor) + counts.reindex(keys, fill_value=floor)
+        bounds = self.errors.reindex(keys, fill_value=own_floor) + errors.reindex(keys, fill_value=floor)
+
+        order = np.argsort(-estimates.to_numpy(), kind='stable')[:self.capacity]
+        self.counts, self.errors = estimates.iloc[order], bounds.iloc[order]
+        self.total += total
+        return self
+
+    def top(self, n=None):
+        """ Keys by descending estimate. """
+        return self.counts if n is None else self.counts.iloc[:n]
+
+    def max_error(self):
+        """ Largest possible overestimate of any reported key; 0 while every key seen still has its own counter. """
+        return float(self.errors.max()) if len(self.errors) else 0.0
+
+
+class HyperLogLog:
+
+    """ Distinct count in 2 ** precision one-byte registers, with a relative standard error of 1.04 / sqrt(2 ** precision). """
+
+    def __init__(self, precision=14):
+        self.precision = int(precision)
+        self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+
+    @staticmethod
+    def for_error(epsilon):
+        """ The smallest register array whose standard error is at most epsilon (between 2 ** 4 and 2 ** 18 registers). """
+        return HyperLogLog(min(18, max(4, math.ceil(2 * math.log2(1.04 / epsilon)))))
+
+    def update(self, values):
+        """ Add the non-missing values of an array or Series. """
+        values = pd.Series(values).dropna()
+        if values.empty:
+            return self
+        hashes = pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+        # The top bits pick a register, the low 32 bits give the rank (position of the first set bit)
+        buckets = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        rest = (hashes & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        ranks = np.where(rest > 0, 32 - np.floor(np.log2(np.maximum(rest, 1))), 33).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+        return self
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+
+        # Small cardinalities are counted from the empty registers instead (linear counting)
+        empty = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and empty:
+            return m * math.log(m / empty)
+        return float(raw)
+
+    def standard_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
@@ -0,0 +1,233 @@
+import glob
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .data_handler import DataHandler
+from .event_aggregates import EventAggregates
+from .uuid_dictionary import UuidDictionary
+from .viewerDataAnalyzer import ReadTimeAccumulator
+from .profiler import Profiler
+
+class TimeBucketIndex:
+
+    """ Per-hour or per-day partial aggregates of an event log, so a time window is answered by combining buckets. """
+
+    BUCKET_SECONDS = {'hour': 3600, 'day': 86400}
+
+    # Columns read while building; every windowed task is answered from these
+    COLUMNS = ['ts', 'visitor_country', 'visitor_useragent', 'visitor_uuid', 'event_type', 'event_readtime']
+
+    # Tasks whose aggregates are kept per bucket; the others need the rows of the window
+    TASKS = ('2a', '2b', '3a', '3b', '4')
+
+    def __init__(self, bucket='hour'):
+        self.bucket = bucket
+        self.seconds = TimeBucketIndex.BUCKET_SECONDS[bucket]
+        self.visitors = UuidDictionary()
+
+        # Series with a (bucket start, key) MultiIndex, sorted so a window is one slice
+        self.country = pd.Series(dtype='int64')
+        self.useragent = pd.Series(dtype='int64')
+        self.read_time = pd.Series(dtype='float64')
+        self.country_parts, self.useragent_parts, self.read_time_parts = [], [], []
+
+        # Where the rows of partial buckets at the edges of a window are read from: a file path or a DataFrame
+        self.source = None
+
+    @staticmethod
+    def parse_time(value):
+        """ Epoch seconds of a --since/--until value: epoch seconds, or an ISO date or datetime taken as UTC. """
+        if value is None or isinstance(value, (int, float)):
+            return value
+        value = str(value).strip()
+        if value.isdigit():
+            return int(value)
+        timestamp = pd.Timestamp(value)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.tz_localize('UTC')
+        return int(timestamp.timestamp())
+
+    @staticmethod
+    def format_time(seconds):
+        return pd.Timestamp(int(seconds), unit='s').strftime('%Y-%m-%d %H:%M UTC')
+
+    @staticmethod
+    def describe(since=None, until=None):
+        """ A window as printed by the CLI; open ends are shown as such. """
+        start = 'the first event' if since is None else TimeBucketIndex.format_time(since)
+        end = 'the last event' if until is None else TimeBucketIndex.format_time(until)
+        return f"from {start} up to {end}"
+
+    @staticmethod
+    def index_path(file_name, bucket):
+        """ Stored next to the Parquet cache and keyed by the same file fingerprint. """
+        cache = os.path.basename(DataHandler.cache_path(file_name))
+        return os.path.join(DataHandler.CACHE_DIR, 'time_index', cache.replace('.parquet', f".{bucket}.pkl"))
+
+    @staticmethod
+    def for_file(file_name, bucket='hour'):
+        """ Load the index of this version of the file, or build it in one pass and store it. """
+        if not DataHandler.use_cache:
+            index = TimeBucketIndex.from_chunks(DataHandler.iter_chunks(file_name, TimeBucketIndex.COLUMNS), bucket)
+            index.source = file_name
+            return index
+
+        path = TimeBucketIndex.index_path(file_name, bucket)
+        if os.path.exists(path):
+            with open(path, 'rb') as handle:
+                index = pickle.load(handle)
+            index.source = file_name
+            return index
+
+        index = TimeBucketIndex.from_chunks(DataHandler.iter_chunks(file_name, TimeBucketIndex.COLUMNS), bucket)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, 'wb') as handle:
+            pickle.dump(index, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, path)
+
+        # Drop indexes of earlier versions of the same file, as build_cache does for the Parquet cache
+        for stale in glob.glob(path.rsplit('-', 1)[0] + f"-*.{bucket}.pkl"):
+            if stale != path:
+                os.remove(stale)
+
+        index.source = file_name
+        return index
+
+    @staticmethod
+    def from_chunks(chunks, bucket='hour'):
+        with Profiler.stage('build time index'):
+            index = TimeBucketIndex(bucket)
+            for chunk in chunks:
+                index.add_chunk(chunk)
+            return index.finish()
+
+    @staticmethod
+    def from_frame(df, bucket='hour'):
+        """ Index of an already loaded DataFrame (the Streamlit upload). """
+        index = TimeBucketIndex.from_chunks([df], bucket)
+        index.source = df
+        return index
+
+    def add_chunk(self, chunk):
+        """ Count one chunk per (bucket, key); events without a timestamp are left out of every window. """
+        chunk = DataHandler.in_window(chunk) if 'ts' in chunk else chunk.iloc[0:0]
+        buckets = pd.Series((chunk['ts'].to_numpy(dtype=np.int64) // self.seconds) * self.seconds,
+                            index=chunk.index, name='bucket')
+
+        # The same keys the full-file aggregates count, so an unbounded window gives identical results
+        if 'visitor_country' in chunk:
+            self.country_parts.append(chunk.groupby([buckets, chunk['visitor_country']], observed=True).size())
+        if 'visitor_useragent' in chunk:
+            self.useragent_parts.append(chunk.groupby([buckets, chunk['visitor_useragent'].astype(str)]).size())
+
+        if 'visitor_uuid' in chunk:
+            # Every visitor is interned in file order, as EventAggregates does, so ties rank the same way
+            codes = DataHandler.intern_uuids(chunk[['visitor_uuid']], {'visitor_uuid': self.visitors})['visitor_uuid'].to_numpy()
+            if 'event_type' in chunk and 'event_readtime' in chunk:
+                reads = (chunk['event_type'] == 'pagereadtime').to_numpy() & (codes >= 0)
+                read_times = np.nan_to_num(chunk['event_readtime'].to_numpy(dtype=np.float64)[reads])
+                self.read_time_parts.append(pd.Series(read_times).groupby([buckets.to_numpy()[reads], codes[reads]]).sum())
+
+    @staticmethod
+    def fold(parts, current):
+        parts = [part for part in [current] + parts if len(part)]
+        if not parts:
+            return current
+        return pd.concat(parts).groupby(level=[0, 1]).sum().sort_index()
+
+    def finish(self):
+        """ Fold the per-chunk parts into one sorted Series per aggregate. """
+        self.country = TimeBucketIndex.fold(self.country_parts, self.country)
+        self.useragent = TimeBucketIndex.fold(self.useragent_parts, self.useragent)
+        self.read_time = TimeBucketIndex.fold(self.read_time_parts, self.read_time)
+        self.country_parts, self.useragent_parts, self.read_time_parts = [], [], []
+        return self
+
+    def span(self):
+        """ First and last bucket start seen, or (None, None) for an empty index. """
+        starts = [series.index.get_level_values(0) for series in (self.country, self.useragent, self.read_time) if len(series)]
+        if not starts:
+            return None, None
+        return int(min(part.min() for part in starts)), int(max(part.max() for part in starts))
+
+    def interior(self, since=None, until=None):
+        """ The whole buckets inside [since, until) as (start, end), and the partial windows left at either edge. """
+        first, last = self.span()
+        start = first if since is None else -(-int(since) // self.seconds) * self.seconds
+        end = last + self.seconds if until is None else (int(until) // self.seconds) * self.seconds
+        if start >= end:
+            # No whole bucket fits: the window is all edge
+            return None, [(since, until)]
+
+        edges = []
+        if since is not None and since < start:
+            edges.append((since, start))
+        if until is not None and end < until:
+            edges.append((end, until))
+        return (start, end), edges
+
+    def rows_between(self, since, until):
+        """ Chunks of the source rows with since <= ts < until. """
+        if isinstance(self.source, pd.DataFrame):
+            yield DataHandler.in_window(self.source, since, until)
+        elif self.source is not None:
+            yield from DataHandler.iter_window_chunks(self.source, TimeBucketIndex.COLUMNS, since, until)
+
+    @staticmethod
+    def window_counts(series, start=None, end=None):
+        """ Sum per key of the buckets in [start, end); all buckets when a bound is None. """
+        if not len(series):
+            return series.droplevel(0) if isinstance(series.index, pd.MultiIndex) else series
+        buckets = series.index.get_level_values(0)
+        keep = np.ones(len(series), dtype=bool)
+        if start is not None:
+            keep &= buckets >= start
+        if end is not None:
+            keep &= buckets < end
+        return series[keep].groupby(level=1, observed=True).sum().rename('count')
+
+    @staticmethod
+    def add_counts(parts):
+        parts = [part for part in parts if len(part)]
+        if len(parts) <= 1:
+            return parts[0] if parts else pd.Series(dtype='int64')
+        return pd.concat(parts).groupby(level=0, observed=True).sum().rename('count')
+
+    def window(self, since=None, until=None):
+        """ EventAggregates of tasks 2a-4 over [since, until), as a scan of the window's rows would count them.
+
+        Whole buckets come from the index; the rows of the partial buckets at either edge are read from the
+        source (a pushed-down read of the Parquet cache when there is one). """
+        aggregates = EventAggregates(TimeBucketIndex.TASKS)
+        aggregates.visitors = self.visitors
+        aggregates.read_time = ReadTimeAccumulator(self.visitors)
+        if self.span()[0] is None:
+            aggregates.country = DataHandler.combine_counts([])
+            aggregates.useragent = DataHandler.combine_counts([])
+            return aggregates
+
+        interior, edges = self.interior(since, until)
+        parts = [(self.country, self.useragent, self.read_time, interior or (0, 0))]
+        if edges and self.source is None:
+            raise ValueError("a window that does not line up with the buckets needs the index's source rows")
+        if edges:
+            # The edge rows share this index's visitor codes, so their read times add up with the buckets'
+            partial = TimeBucketIndex(self.bucket)
+            partial.visitors = self.visitors
+            for edge in edges:
+                for chunk in self.rows_between(*edge):
+                    partial.add_chunk(chunk)
+            partial.finish()
+            parts.append((partial.country, partial.useragent, partial.read_time, (None, None)))
+
+        aggregates.country = DataHandler.combine_counts(
+            [TimeBucketIndex.add_counts([TimeBucketIndex.window_counts(country, *span) for country, _, _, span in parts])])
+        aggregates.useragent = DataHandler.combine_counts(
+            [TimeBucketIndex.add_counts([TimeBucketIndex.window_counts(useragent, *span) for _, useragent, _, span in parts])])
+        totals = TimeBucketIndex.add_counts([TimeBucketIndex.window_counts(read_time, *span) for _, _, read_time, span in parts])
+        aggregates.read_time.add_codes(totals.index.to_numpy(dtype=np.int64), totals.to_numpy())
+        return aggregates
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+class UserAgentCache:
+
+    """ Bounded LRU of user agent string -> (browser, os, device) family, persisted as JSON. """
+
+    FIELDS = ('browser', 'os', 'device')
+    UNKNOWN = ('Unknown', 'Unknown', 'Unknown')
+
+    def __init__(self, path=None, maxsize=100000):
+        self.path = path
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.dirty = False
+
+        # Streamlit sessions share one cache from their own threads
+        self.lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as handle:
+                    for ua, families in json.load(handle):
+                        self.entries[ua] = tuple(families)
+            except (OSError, ValueError):
+                # A damaged cache file is simply rebuilt
+                self.entries.clear()
+
+    def lookup(self, ua):
+        """ Families of one user agent, parsing it only on a cache miss. """
+        if not isinstance(ua, str) or not ua:
+            return UserAgentCache.UNKNOWN
+
+        with self.lock:
+            families = self.entries.get(ua)
+            if families is not None:
+                self.entries.move_to_end(ua)
+                return families
+
+        # user_agents loads a large regex table, so it is only imported once a parse is needed; parsing happens
+        # outside the lock, so two threads may parse the same new user agent
+        from user_agents import parse
+
+        parsed = parse(ua)
+        families = (parsed.browser.family, parsed.os.family, parsed.device.family)
+        with self.lock:
+            self.entries[ua] = families
+            self.dirty = True
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return families
+
+    def families(self, useragents, field='browser'):
+        """ Family of each user agent in an array-like of distinct strings. """
+        position = UserAgentCache.FIELDS.index(field)
+        return [self.lookup(ua)[position] for ua in useragents]
+
+    def save(self):
+        """ Write the cache back to disk if new user agents were parsed. """
+        with self.lock:
+            if not self.path or not self.dirty:
+                return
+            snapshot = [[ua, list(families)] for ua, families in self.entries.items()]
+            self.dirty = False
+
+        # Each writer gets its own temporary file; the last rename wins
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, prefix=os.path.basename(self.path), suffix='.tmp',
+                                         delete=False) as handle:
+            json.dump(snapshot, handle)
+        os.replace(handle.name, self.path)
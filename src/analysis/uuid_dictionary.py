@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+class UuidDictionary:
+
+    """ Reversible mapping of UUID strings to dense int32 codes, assigned in order of first appearance. """
+
+    def __init__(self):
+        self.codes = {}
+        self.uuids = []
+
+    def __len__(self):
+        return len(self.uuids)
+
+    def encode_unique(self, uuids):
+        """ Codes of distinct UUIDs, registering unseen ones. """
+        codes = np.empty(len(uuids), dtype=np.int32)
+        for position, uuid in enumerate(uuids):
+            code = self.codes.get(uuid)
+            if code is None:
+                code = self.codes[uuid] = len(self.uuids)
+                self.uuids.append(uuid)
+            codes[position] = code
+        return codes
+
+    def encode(self, values):
+        """ int32 codes of a UUID column; missing values get -1. Each distinct value is looked up once. """
+        inverse, uniques = pd.factorize(np.asarray(values, dtype=object))
+        mapping = np.append(self.encode_unique(uniques), np.int32(-1))
+        return mapping[inverse]
+
+    def code_of(self, uuid):
+        """ Code of one UUID, or -1 if it was never seen. """
+        return self.codes.get(uuid, -1)
+
+    def decode(self, codes):
+        """ UUID strings of an array of codes. """
+        return np.asarray(self.uuids, dtype=object)[np.asarray(codes)] if len(codes) else np.array([], dtype=object)
+
+    def absorb(self, other):
+        """ Add another dictionary's UUIDs; returns the array mapping its codes to codes in this one. """
+        return self.encode_unique(other.uuids)
+
+    def categorical(self, codes):
+        """ A categorical column over this dictionary, sharing the codes instead of copying strings. """
+        return pd.Categorical.from_codes(codes, categories=pd.Index(self.uuids, dtype=object))
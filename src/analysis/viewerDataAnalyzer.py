@@ -1,18 +1,109 @@
+import numpy as np
+import pandas as pd
 from tabulate import tabulate
+from .data_handler import DataHandler
+from .uuid_dictionary import UuidDictionary
+from .profiler import Profiler
+
+class ReadTimeAccumulator:
+
+    """ Per-visitor read time summed across chunks in a dense array indexed by the visitor's int32 code. """
+
+    def __init__(self, visitors=None):
+        self.visitors = visitors if visitors is not None else UuidDictionary()
+        self.totals = np.zeros(1024, dtype=np.float64)
+        self.active = np.zeros(1024, dtype=bool)
+
+    def __len__(self):
+        return len(self.visitors)
+
+    def reserve(self):
+        """ Grow the totals array to cover every code in the (possibly shared) dictionary. """
+        if len(self.visitors) > len(self.totals):
+            size = max(len(self.visitors), 2 * len(self.totals))
+            self.totals = np.concatenate([self.totals, np.zeros(size - len(self.totals), dtype=np.float64)])
+            self.active = np.concatenate([self.active, np.zeros(size - len(self.active), dtype=bool)])
+
+    def add_codes(self, visitor_codes, read_times):
+        """ Add one batch of (visitor code, read time) events; cost is proportional to the batch. """
+        self.reserve()
+        keep = visitor_codes >= 0
+        np.add.at(self.totals, visitor_codes[keep], np.nan_to_num(np.asarray(read_times, dtype=np.float64)[keep]))
+        self.active[visitor_codes[keep]] = True
+        return self
+
+    def add(self, visitor_uuids, read_times):
+        """ Add one batch of (visitor UUID, read time) events. """
+        return self.add_codes(self.visitors.encode(visitor_uuids), read_times)
+
+    def add_chunk(self, df):
+        """ Add the pagereadtime events of a DataFrame chunk (UUIDs or already encoded codes). """
+        df = df[df['event_type'] == 'pagereadtime']
+        if not pd.api.types.is_integer_dtype(df['visitor_uuid'].dtype):
+            df = DataHandler.intern_uuids(df, {'visitor_uuid': self.visitors})
+        return self.add_codes(df['visitor_uuid'].to_numpy(), df['event_readtime'].to_numpy())
+
+    def merge(self, other, mapping=None):
+        """ Fold another accumulator in; `mapping` translates its visitor codes if already computed. """
+        if mapping is None:
+            mapping = self.visitors.absorb(other.visitors)
+        self.reserve()
+
+        # Visitors beyond the other's array (added to a shared dictionary after its last read) have no read time
+        known = min(len(other), len(other.totals))
+        if known:
+            np.add.at(self.totals, mapping[:known], other.totals[:known])
+            self.active[mapping[:known]] |= other.active[:known]
+        return self
+
+    @Profiler.timed('top readers')
+    def top(self, n=10):
+        """ The n visitors with the largest total read time, selected without sorting every visitor. """
+        # Visitors known only from other events (no pagereadtime) are not readers
+        readers = np.flatnonzero(self.active[:len(self)])
+        totals = self.totals[readers]
+        if len(totals) > n:
+            candidates = np.argpartition(-totals, n - 1)[:n]
+        else:
+            candidates = np.arange(len(totals))
+        candidates = candidates[np.argsort(-totals[candidates], kind='stable')]
+        order, totals = readers[candidates], totals[candidates]
+
+        # Only the winners are decoded back to UUID strings
+        index = pd.Index(self.visitors.decode(order), name='visitor_uuid')
+        return pd.Series(totals, index=index, name='event_readtime')
 
 class ViewerDataAnalyzer:
 
     @staticmethod
-    def calculate_reading_times(df):
-       
+    def read_time_per_visitor(df):
+        """ Total page read time of each visitor in the frame. """
         df = df[df['event_type'] == 'pagereadtime']
-        read_time_per_user = df.groupby('visitor_uuid')['event_readtime'].sum()
-        top_readers = read_time_per_user.sort_values(ascending=False).head(10)
+        return df.groupby('visitor_uuid', observed=True)['event_readtime'].sum()
+
+    @staticmethod
+    def calculate_reading_times(df, n=10):
+       
+        read_time_per_user = ViewerDataAnalyzer.read_time_per_visitor(df)
+        top_readers = read_time_per_user.nlargest(n)
         return top_readers
+
+    @staticmethod
+    def calculate_reading_times_from_chunks(chunks, n=10):
+        """ Top n readers over a stream of DataFrame chunks, holding only one total per visitor in memory. """
+        accumulator = ReadTimeAccumulator()
+        for chunk in chunks:
+            accumulator.add_chunk(chunk)
+        return accumulator.top(n)
+
+    @staticmethod
+    def calculate_reading_times_between(index, since=None, until=None, n=10):
+        """ Top n readers by read time in [since, until), combined from the buckets of a TimeBucketIndex. """
+        return index.window(since, until).top_readers(n)
     
-    def print_top_readers(top_readers):
+    def print_top_readers(top_readers, n=10):
         if top_readers is not None and not top_readers.empty:
-            print("\nTop 10 Readers (UUID and Total Read Time in Milliseconds):\n")
+            print(f"\nTop {n} Readers (UUID and Total Read Time in Milliseconds):\n")
 
             # Convert the Series to a DataFrame for pretty printing as a table
             top_readers_df = top_readers.reset_index()
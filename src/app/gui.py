@@ -3,6 +3,9 @@ import pandas as pd
 import plotly.express as px
 import sys
 import os
+import hashlib
+import threading
+from collections import OrderedDict
 import streamlit.components.v1 as components
 
 # Get the directory of the current file (src/app/)
@@ -19,14 +22,152 @@ from analysis.data_handler import DataHandler
 from analysis.browserDataAnalyzer import BrowserDataAnalyzer
 from analysis.viewerDataAnalyzer import ViewerDataAnalyzer
 from analysis.alsoLikesAnalyzer import AlsoLikesAnalyzer
+from analysis.profiler import Profiler
+from analysis.time_index import TimeBucketIndex
+from analysis.compressed_source import CompressedSource
+
+
+class DatasetCache:
+    """ Process-wide LRU of parsed uploads and everything derived from them, keyed by upload content hash. """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+
+        # Sessions run on their own threads and share this cache; held only around bookkeeping, never while computing
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def content_key(uploaded_file):
+        return hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def size_of(value):
+        """ Rough in-memory size of a cached value, used for eviction. """
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            size = value.memory_usage(deep=True)
+            return int(size.sum()) if isinstance(size, pd.Series) else int(size)
+        if isinstance(value, AlsoLikesAnalyzer) and value.index is not None:
+            return sum(getattr(part, 'nbytes', 0) for part in value.index.values())
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        if isinstance(value, tuple):
+            return sum(DatasetCache.size_of(part) for part in value)
+        return 0
+
+    def touch(self, key):
+        """ The entry of an upload, created empty and marked most recently used; the caller holds the lock. """
+        if key not in self.entries:
+            self.entries[key] = {'df': None, 'results': {}, 'bytes': 0}
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def entry(self, key):
+        """ The cache entry of an upload, created empty: nothing is parsed until a result needs it. """
+        with self.lock:
+            return self.touch(key)
+
+    def frame(self, key, load):
+        """ The parsed DataFrame of an upload, loading it only the first time it is needed. """
+        with self.lock:
+            df = self.touch(key)['df']
+        if df is not None:
+            return df
+
+        # Parsed without the lock so other sessions are not held up; a concurrent miss may parse twice
+        df = load()
+        with self.lock:
+            entry = self.touch(key)
+            if entry['df'] is None:
+                entry['df'] = df
+                entry['bytes'] += DatasetCache.size_of(df)
+                self.evict(keep=key)
+            return entry['df']
+
+    def loaded(self, key):
+        """ The parsed DataFrame of an upload if a full load already happened, otherwise None. """
+        with self.lock:
+            return self.entries[key]['df'] if key in self.entries else None
+
+    def result(self, key, name, compute):
+        """ A derived result (aggregate, index, rendered graph) of an upload, computed once. """
+        with self.lock:
+            results = self.touch(key)['results']
+            if name in results:
+                return results[name]
+
+        value = compute()
+        with self.lock:
+            entry = self.touch(key)
+            if name not in entry['results']:
+                entry['results'][name] = value
+                entry['bytes'] += DatasetCache.size_of(value)
+                self.evict(keep=key)
+            return entry['results'][name]
+
+    def evict(self, keep):
+        """ Drop least recently used uploads until the cache fits in its memory cap; the caller holds the lock. """
+        while sum(entry['bytes'] for entry in self.entries.values()) > self.max_bytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            if oldest == keep:
+                self.entries.move_to_end(keep)
+                continue
+            del self.entries[oldest]
+
+
+@st.cache_resource
+def dataset_cache():
+    # Shared by every session of this Streamlit process
+    return DatasetCache(int(os.environ.get('DOC_ANALYZER_CACHE_MB', 2048)) * 1024 * 1024)
 
 
 class StreamlitApp:
 
     def __init__(self):
         self.df = None
+        self.uploaded_file = None
+        self.data_key = None
+        self.document_uuid = None
+        self.window = None
+        self.sample_size = None
+        self.cache = dataset_cache()
         self.setup_page()
 
+    def cached(self, name, compute):
+        """ Result `name` for the current upload, document filter, time window and sample, reused across reruns. """
+        return self.cache.result(self.data_key, (name, self.document_uuid, self.window, self.sample_size), compute)
+
+    def time_index(self):
+        """ Per-day partial aggregates of the upload; date windows line up with day buckets, so they are exact. """
+        return self.cache.result(self.data_key, ('time_index', self.sample_size), lambda: TimeBucketIndex.from_frame(self.df, 'day'))
+
+    def sample(self):
+        """ (reservoir sample of the upload, number of events it was drawn from), drawn once per sample size. """
+        return self.cache.result(self.data_key, ('sample', self.sample_size),
+                                 lambda: DataHandler.reservoir_sample(self.uploaded_file, self.sample_size))
+
+    def frame(self):
+        """ The rows every analysis runs on: the sample in sample mode, otherwise the whole upload, parsed on first use. """
+        if self.sample_size:
+            return self.sample()[0]
+        return self.cache.frame(self.data_key, lambda: DataHandler.load_data(self.uploaded_file))
+
+    def loaded_frame(self):
+        """ The rows already in memory, without triggering a full load. """
+        return self.sample()[0] if self.sample_size else self.cache.loaded(self.data_key)
+
+    def sample_caption(self):
+        sample, seen = self.sample()
+        st.caption(f"🎲 Sample mode: {len(sample):,} of {seen:,} events ({len(sample) / max(seen, 1):.1%}), "
+                   f"drawn uniformly at random. Counts describe the sample; turn sample mode off for exact results.")
+
+    def windowed(self, name, from_index, from_rows):
+        """ Answer from the time index when a window is set over all documents, otherwise from the (filtered) rows. """
+        if self.window and not self.document_uuid:
+            index = self.time_index()
+            return self.cached(name, lambda: from_index(index, *self.window))
+        return self.cached(name, from_rows)
+
     def setup_page(self):
         st.set_page_config(page_title="Document Viewer Analysis", layout="wide")
         st.title("📊 Document Viewer Analysis")
@@ -35,17 +176,25 @@ class StreamlitApp:
     def upload_data(self):
         with st.sidebar:
             st.header("📁 Data Upload")
-            uploaded_file = st.file_uploader("Choose a JSON file", type="json")
+            uploaded_file = st.file_uploader("Choose a JSON file", type=["json"] + CompressedSource.EXTENSIONS,
+                                             help="Plain JSON lines, or compressed with gzip, bzip2, xz or zstd")
             if uploaded_file is not None:
-                self.df = DataHandler.load_data(uploaded_file)
+                # Only hashed here; the upload is parsed when an analysis first needs its rows
+                self.uploaded_file = uploaded_file
+                self.data_key = DatasetCache.content_key(uploaded_file)
+                self.cache.entry(self.data_key)
             return uploaded_file
 
-    def display_file_info(self, df):
+    def display_file_info(self):
             """Display initial information about the uploaded file."""
             st.write("## File Overview")
             st.write("Here's a quick overview of the uploaded file:")
-            st.dataframe(df.head())  # Show the first few rows of the dataframe
-            st.write(f"**Total rows: {len(df)}**")  # Display the total number of rows in the dataframe
+            # Only the first lines are parsed and the rows are counted as newlines, so this shows before any full load
+            st.dataframe(self.cache.result(self.data_key, ('head',), lambda: DataHandler.read_head(self.uploaded_file)))
+            rows = self.cache.result(self.data_key, ('row_count',), lambda: DataHandler.count_lines(self.uploaded_file))
+            st.write(f"**Total rows: {rows}**")
+            if self.sample_size:
+                self.sample_caption()
 
     def input_fields(self):
         with st.sidebar:
@@ -58,8 +207,36 @@ class StreamlitApp:
                                                help="Enter the UUID of the visitor for more detailed analysis. "
                                                     "This field is required for generating the graph.")
 
+            self.sample_size = self.sample_mode()
+            self.window = self.time_window()
             return document_uuid, visitor_uuid_input
 
+    def sample_mode(self):
+        """ Number of events to sample when sample mode is on, or None to analyse the whole upload. """
+        if not st.checkbox("Sample mode", help="Run every analysis on a uniform random sample of the events instead of "
+                                                "parsing the whole upload. Faster on large files; results are estimates."):
+            return None
+        return int(st.number_input("Sample size (events)", min_value=1000, value=100000, step=10000))
+
+    def time_window(self):
+        """ (since, until) epoch seconds of the dates picked in the sidebar, or None for the whole upload. """
+        # The date range comes from rows already in memory; without sample mode it shows once a full load has happened
+        df = self.loaded_frame()
+        if df is None or 'ts' not in df or not df['ts'].notna().any():
+            return None
+
+        first = pd.Timestamp(int(df['ts'].min()), unit='s').date()
+        last = pd.Timestamp(int(df['ts'].max()), unit='s').date()
+        dates = st.date_input("Time window (UTC)", value=(first, last), min_value=first, max_value=last,
+                              help="Only count views on these days. Applies to the country, browser and reader analyses.")
+
+        # While the second date is being picked the widget returns a single date
+        if not isinstance(dates, (list, tuple)) or len(dates) != 2 or tuple(dates) == (first, last):
+            return None
+        since = TimeBucketIndex.parse_time(dates[0].isoformat())
+        until = TimeBucketIndex.parse_time(dates[1].isoformat()) + TimeBucketIndex.BUCKET_SECONDS['day']
+        return since, until
+
     def analysis_options(self):
         with st.sidebar:
             st.markdown("---")
@@ -81,7 +258,8 @@ class StreamlitApp:
             Below is a bar chart representing the number of views per country. Hover over the bars to see the exact number of views.
         """, unsafe_allow_html=True)
 
-        country_count = GeoDataAnalyzer.get_country_counts(filtered_df)
+        country_count = self.windowed('country_counts', GeoDataAnalyzer.get_country_counts_between,
+                                      lambda: GeoDataAnalyzer.get_country_counts(filtered_df))
         fig = GeoDataAnalyzer.create_analysis_by_country(country_count)
         
         # Optionally customize the Plotly figure with a theme or layout adjustments
@@ -106,7 +284,8 @@ class StreamlitApp:
             Hover over the bars to see detailed counts for each continent.
         """, unsafe_allow_html=True)
 
-        continent_count = GeoDataAnalyzer.get_continent_counts(data)
+        continent_count = self.windowed('continent_counts', GeoDataAnalyzer.get_continent_counts_between,
+                                        lambda: GeoDataAnalyzer.get_continent_counts(data))
         fig = GeoDataAnalyzer.create_analysis_by_continent(continent_count)
         
         # Customize the Plotly figure with a theme or layout adjustments
@@ -136,7 +315,8 @@ class StreamlitApp:
         """, unsafe_allow_html=True)
 
         # Process the browser data (assumes this returns a Series with browser counts)
-        browser_data = BrowserDataAnalyzer.process_browser_data(data, detailed=False)
+        browser_data = self.windowed('main_browser_counts', BrowserDataAnalyzer.process_browser_data_between,
+                                     lambda: BrowserDataAnalyzer.process_browser_data(data[['visitor_useragent']].copy(), detailed=False))
         
         # Use the new function to create the chart
         fig = BrowserDataAnalyzer.create_analysis_by_main_browser(browser_data)
@@ -161,7 +341,8 @@ class StreamlitApp:
         """, unsafe_allow_html=True)
 
         # Process the browser data (assumes this returns a Series with browser counts)
-        browser_data = BrowserDataAnalyzer.process_browser_data(data, detailed=True)
+        browser_data = self.windowed('browser_counts', lambda index, since, until: BrowserDataAnalyzer.process_browser_data_between(index, since, until, detailed=True),
+                                     lambda: BrowserDataAnalyzer.process_browser_data(data[['visitor_useragent']].copy(), detailed=True))
         
         # Use the new function to create the chart
         fig = BrowserDataAnalyzer.create_analysis_by_main_browser(browser_data)
@@ -185,7 +366,8 @@ class StreamlitApp:
             This information provides insights into the most engaged users.
         """, unsafe_allow_html=True)
 
-        top_readers =  ViewerDataAnalyzer.calculate_reading_times(data) # Replace with your actual method call
+        top_readers = self.windowed('top_readers', ViewerDataAnalyzer.calculate_reading_times_between,
+                                    lambda: ViewerDataAnalyzer.calculate_reading_times(data))
         if top_readers is not None and not top_readers.empty:
             # Convert the Series to a DataFrame for displaying as a table
             top_readers_df = top_readers.reset_index()
@@ -204,8 +386,8 @@ class StreamlitApp:
             The table below lists documents that readers of the specified document also liked.
         """, unsafe_allow_html=True)
 
-        analytics = AlsoLikesAnalyzer(mainData)
-        top_liked_docs = analytics.get_top_10_also_likes(document_uuid)
+        analytics = self.also_likes_analyzer(mainData)
+        top_liked_docs = self.cached('top_liked_docs', lambda: analytics.get_top_10_also_likes(document_uuid))
         
         if top_liked_docs.empty:
             st.write("No top liked documents found.")
@@ -215,6 +397,14 @@ class StreamlitApp:
             top_liked_docs_df.columns = ['Document UUID', 'Read Count']
             st.table(top_liked_docs_df)
 
+    def also_likes_analyzer(self, mainData):
+        """ One AlsoLikesAnalyzer (and reader index) per upload, shared by every document query. """
+        def build():
+            analytics = AlsoLikesAnalyzer(mainData)
+            analytics.build_index()
+            return analytics
+        return self.cache.result(self.data_key, ('also_likes_analyzer', self.sample_size), build)
+
     # Assuming 'graph' is a Graphviz dot object
     def display_graphviz(self,mainData, document_uuid, user_uuid):
 
@@ -226,11 +416,11 @@ class StreamlitApp:
             The graph below maps documents that readers of the specified document also liked.
         """, unsafe_allow_html=True)
 
-        analytics = AlsoLikesAnalyzer(mainData)
-        top_liked_docs = analytics.get_top_10_also_likes(document_uuid)
-        graph = analytics.create_also_likes_graph(document_uuid, user_uuid, top_liked_docs)
+        analytics = self.also_likes_analyzer(mainData)
+        top_liked_docs = self.cached('top_liked_docs', lambda: analytics.get_top_10_also_likes(document_uuid))
+        graph = self.cached(f'graph:{user_uuid}', lambda: analytics.create_also_likes_graph(document_uuid, user_uuid, top_liked_docs))
 
-        svg = graph.pipe(format='svg').decode('utf-8')
+        svg = self.cached(f'graph_svg:{user_uuid}', lambda: AlsoLikesAnalyzer.render_graph(graph, 'svg').decode('utf-8'))
 
        # Estimate height: 100 pixels for each node or row of nodes
         estimated_height_per_node = 25
@@ -253,11 +443,17 @@ class StreamlitApp:
     def display_analysis(self, document_uuid, visitor_uuid_input, options):
         show_country, show_continent, show_detailed_browser, show_main_browser, show_top_readers, show_also_likes, show_graph = options
 
+        self.df = self.frame()
         mainData = self.df
+        self.document_uuid = document_uuid or None
+        if self.sample_size:
+            self.sample_caption()
 
         if document_uuid:
 
-            data = self.df[self.df['subject_doc_id'] == document_uuid]
+            data = self.cached('filtered_data', lambda: self.df[self.df['subject_doc_id'] == document_uuid])
+            if self.window:
+                data = self.cached('windowed_data', lambda: DataHandler.in_window(data, *self.window))
 
         else:
 
@@ -301,7 +497,26 @@ class StreamlitApp:
         elif show_graph:
             st.warning("Please enter a Document UUID and Visitor UUID to view the list of recommended documents.")
 
+    def display_profile(self, profiler):
+        """ Show the stages of this rerun; results served from the dataset cache show up as cheap stages. """
+        with st.expander("⏱️ Profile of this run", expanded=True):
+            st.dataframe(profiler.frame(), use_container_width=True)
+            peak_rss = Profiler.peak_rss_mb()
+            st.caption(f"Total {profiler.total_seconds:.3f} s" + (f", peak resident memory {peak_rss:.1f} MiB" if peak_rss is not None else ""))
+
     def run(self):
+        # The checkbox is drawn last in the sidebar, so its value is read from the session state of the previous run
+        if not st.session_state.get('profile', False):
+            self.analyze()
+        else:
+            with Profiler() as profiler:
+                self.analyze()
+            self.display_profile(profiler)
+
+        st.sidebar.checkbox("Profile analysis", key='profile',
+                            help="Record time, rows and peak memory of each stage (parsing, aggregation, UA parsing, Graphviz)")
+
+    def analyze(self):
         uploaded_file = self.upload_data()
 
         if uploaded_file is not None:
@@ -317,7 +532,7 @@ class StreamlitApp:
             else:
 
                 # If no option is selected, display the file info
-                self.display_file_info(self.df)
+                self.display_file_info()
 
         else:
             st.info("Please upload a file to begin analysis.")
@@ -1,110 +1,479 @@
 # importing necessary libraries and classes
 import argparse
+import os
 import sys
 import subprocess
+import time
+from tabulate import tabulate
 from src.analysis.data_handler import DataHandler 
-from src.analysis.geoDataAnalyzer import GeoDataAnalyzer
-from src.analysis.browserDataAnalyzer import BrowserDataAnalyzer
-from src.analysis.viewerDataAnalyzer import ViewerDataAnalyzer
-from src.analysis.alsoLikesAnalyzer import AlsoLikesAnalyzer
+from src.analysis.event_aggregates import EventAggregates
+from src.analysis.chart_exporter import ChartExporter
+from src.analysis.profiler import Profiler
 
+# Analyzers are imported inside the task branches that use them, so a run
+# only pays for the plotting, user agent and graph libraries it needs
 class CLIHandler:
 
+    # Modules each task imports on top of the CLI itself, used by --import_times
+    TASK_IMPORTS = {
+        '2a': ['src.analysis.geoDataAnalyzer', 'plotly.express', 'plotly.io'],
+        '2b': ['src.analysis.geoDataAnalyzer', 'pycountry_convert', 'plotly.express', 'plotly.io'],
+        '3a': ['src.analysis.browserDataAnalyzer', 'user_agents', 'plotly.express', 'plotly.io'],
+        '3b': ['src.analysis.browserDataAnalyzer', 'user_agents', 'plotly.express', 'plotly.io'],
+        '4': ['src.analysis.viewerDataAnalyzer'],
+        '5d': ['src.analysis.alsoLikesAnalyzer'],
+        '5e': ['src.analysis.alsoLikesAnalyzer', 'scipy.sparse'],
+        '6': ['src.analysis.alsoLikesAnalyzer', 'graphviz'],
+        '7': ['src.analysis.alsoLikesAnalyzer', 'graphviz'],
+    }
+
     def __init__(self, args):
         self.args = args
     
 
+    @staticmethod
+    def parse_tasks(task_arg):
+        """ Split a comma separated task list such as '2a,2b,4' and reject unknown task IDs. """
+        tasks = []
+        for task in task_arg.split(','):
+            task = task.strip()
+            if task and task not in tasks:
+                tasks.append(task)
+
+        unknown = [task for task in tasks if task not in DataHandler.TASK_COLUMNS]
+        if unknown or not tasks:
+            print(f"Error: unknown task ID(s): {', '.join(unknown) or task_arg}")
+            sys.exit(1)
+        return tasks
+
+    def check_task_arguments(self, tasks):
+        """ Fail before any parsing if a requested task is missing its UUID arguments. """
+        if '5d' in tasks and not self.args.doc_uuid:
+            print("Error: doc_uuid is required for task 5d")
+            sys.exit(1)
+
+        if '5e' in tasks and not self.args.doc_list:
+            print("Error: doc_list (a file of document UUIDs, or 'all') is required for task 5e")
+            sys.exit(1)
+
+        if '6' in tasks and not (self.args.user_uuid and self.args.doc_uuid):
+            print("Error: doc_uuid and visitor_uuid is required for task 6")
+            sys.exit(1)
+
+        if '7' in tasks and not (self.args.user_uuid and self.args.doc_uuid):
+            print("Error: doc_uuid and visitor_uuid is required")
+            sys.exit(1)
+
+    def time_window(self):
+        """ The (since, until) epoch seconds given by --since/--until, or None when neither is given. """
+        from src.analysis.time_index import TimeBucketIndex
+
+        if self.args.since is None and self.args.until is None:
+            return None
+        try:
+            return TimeBucketIndex.parse_time(self.args.since), TimeBucketIndex.parse_time(self.args.until)
+        except ValueError as error:
+            print(f"Error: --since/--until must be epoch seconds or an ISO date: {error}")
+            sys.exit(1)
+
+    def aggregate(self, tasks, window=None):
+        """ Read the file once and build the aggregates of every requested task in a single pass. """
+        file_name = self.args.file_name
+
+        if window:
+            from src.analysis.time_index import TimeBucketIndex
+
+            print(f"Window {TimeBucketIndex.describe(*window)}")
+
+            # Count tasks over the whole file are answered from per-bucket partials, built once and cached, plus
+            # the rows of the partial buckets at the window's edges
+            if not self.args.doc_uuid and all(task in TimeBucketIndex.TASKS for task in tasks):
+                return TimeBucketIndex.for_file(file_name, self.args.bucket).window(*window)
+
+        # A warm cache is cheaper to read serially than re-parsing the JSON in parallel
+        if self.args.workers > 1 and not DataHandler.has_cache(file_name):
+            return EventAggregates.from_file_parallel(file_name, tasks, self.args.doc_uuid, self.args.workers, window)
+
+        return EventAggregates.from_file(file_name, tasks, self.args.doc_uuid, window=window)
+
+    @staticmethod
+    def import_time(modules):
+        """ Wall time in ms of importing the CLI plus the given modules in a fresh interpreter. """
+        statements = '; '.join(f"import {module}" for module in ['src.cli.cli_handler'] + modules)
+        code = f"import time; start = time.perf_counter(); {statements}; print((time.perf_counter() - start) * 1000)"
+        # Run from the repository root so `src` imports whatever the caller's working directory is
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=root)
+        if result.returncode != 0:
+            return None
+        return float(result.stdout.strip().splitlines()[-1])
+
+    def report_import_times(self, tasks):
+        """ Print the startup import cost of the CLI alone and of each requested task. """
+        rows = [['cli', CLIHandler.import_time([])]]
+        for task in tasks:
+            rows.append([task, CLIHandler.import_time(CLIHandler.TASK_IMPORTS[task])])
+
+        rows = [[task, 'import failed' if ms is None else f"{ms:.0f}"] for task, ms in rows]
+        print(tabulate(rows, headers=['Task', 'Import time (ms)'], tablefmt='grid'))
+
+    def report_profile(self, profiler):
+        """ Print the per-stage profile, or write it to --profile_output. """
+        report = profiler.to_json() if self.args.profile == 'json' else profiler.table()
+        if self.args.profile_output:
+            with open(self.args.profile_output, 'w') as handle:
+                handle.write(report + '\n')
+            print(f"Profile saved as {self.args.profile_output}")
+        else:
+            print(report)
+
+    def serve(self):
+        """ Load the file once and answer task queries over HTTP or a Unix socket until interrupted. """
+        from src.server.analysis_server import AnalysisService, serve
+
+        if not self.args.file_name:
+            print("Error: file_name is required to serve a dataset")
+            sys.exit(1)
+
+        DataHandler.use_cache = not self.args.no_cache
+        serve(AnalysisService(self.args.file_name), self.args.serve)
+
+    def run_remote_tasks(self, tasks):
+        """ Ask a running analysis server for each task and present the answers as a local run would. """
+        from http.client import HTTPException
+        from src.server.analysis_client import AnalysisClient, AnalysisServerError
+
+        self.check_task_arguments(tasks)
+        if '5e' in tasks:
+            print("Error: task 5e is not served; run it without --server")
+            sys.exit(1)
+
+        client = AnalysisClient(self.args.server)
+        exporter = ChartExporter(format=self.args.format)
+        try:
+            for task_id in sorted(tasks, key=lambda task: task == '7'):
+                if task_id == '7':
+                    exporter.export()
+                self.run_remote_task(task_id, client, exporter)
+        except (OSError, HTTPException, AnalysisServerError) as error:
+            print(f"Error: analysis server at {self.args.server} failed: {error}")
+            sys.exit(1)
+        exporter.export()
+
+    def run_remote_task(self, task_id, client, exporter):
+        params = {'doc_uuid': self.args.doc_uuid, 'visitor_uuid': self.args.user_uuid}
+
+        if task_id in ('2a', '2b'):
+            from src.analysis.geoDataAnalyzer import GeoDataAnalyzer
+
+            counts = client.series(client.task(task_id, doc_uuid=self.args.doc_uuid))
+            save = GeoDataAnalyzer.saveAnalysisByCountry if task_id == '2a' else GeoDataAnalyzer.saveAnalysisByContinent
+            save(counts, exporter=exporter)
+
+        elif task_id in ('3a', '3b'):
+            from src.analysis.browserDataAnalyzer import BrowserDataAnalyzer
+
+            counts = client.series(client.task(task_id, doc_uuid=self.args.doc_uuid))
+            name = "detailed_browser_distribution" if task_id == '3a' else "browser_distribution"
+            BrowserDataAnalyzer.saveAnalysisByBrowser(counts, name, detailed=task_id == '3a', exporter=exporter)
+
+        elif task_id == '4':
+            from src.analysis.viewerDataAnalyzer import ViewerDataAnalyzer
+
+            top_readers = client.series(client.task('4', doc_uuid=self.args.doc_uuid, top_n=self.args.top_n))
+            ViewerDataAnalyzer.print_top_readers(top_readers, self.args.top_n)
+
+        elif task_id == '5d':
+            from src.analysis.alsoLikesAnalyzer import AlsoLikesAnalyzer
+
+            top_liked_docs = client.series(client.task('5d', **params))
+            AlsoLikesAnalyzer.print_top_liked_docs(top_liked_docs, self.args.doc_uuid)
+
+        else:
+            from graphviz import Source
+            from src.analysis.alsoLikesAnalyzer import AlsoLikesAnalyzer
+
+            graph = Source(client.task(task_id, **params)['dot'], format='png')
+            AlsoLikesAnalyzer.save_graph(graph, self.args.doc_uuid)
+
+            if task_id == '7':
+                CLIHandler.launch_gui()
+
+    def follow(self, tasks):
+        """ Tail the log, fold in appended lines as they arrive and re-emit the task outputs every --interval seconds. """
+        from src.analysis.log_follower import LogFollower
+        from src.analysis.compressed_source import CompressedSource
+
+        if CompressedSource.detect(self.args.file_name):
+            print("Error: compressed logs cannot be followed; follow the uncompressed log that is being written")
+            sys.exit(1)
+
+        if '7' in tasks:
+            print("Error: task 7 launches the GUI and cannot be followed")
+            sys.exit(1)
+
+        store = self.open_store() if self.args.store and '5d' in tasks else None
+
+        follower = LogFollower(self.args.file_name, tasks, self.args.doc_uuid)
+        if follower.offset:
+            print(f"Resuming {self.args.file_name} at byte {follower.offset}")
+
+        last_emit, changed = 0.0, False
+        try:
+            while True:
+                fresh = follower.poll()
+                if fresh is not None:
+                    changed = True
+                    if store:
+                        store.ingest_pairs(fresh.reading_pairs())
+
+                if changed and time.monotonic() - last_emit >= self.args.interval:
+                    self.emit(tasks, follower, store)
+                    last_emit, changed = time.monotonic(), False
+
+                time.sleep(min(self.args.interval, 1.0))
+        except KeyboardInterrupt:
+            if changed:
+                self.emit(tasks, follower, store)
+            print("Stopped following")
+
+    def emit(self, tasks, follower, store=None):
+        """ Write every task's output from the follower's current aggregates and checkpoint its state. """
+        print(f"\n=== {time.strftime('%H:%M:%S')} {self.args.file_name} up to byte {follower.offset} ===")
+        exporter = ChartExporter(format=self.args.format)
+        for task_id in tasks:
+            self.run_task(task_id, follower.aggregates, store, exporter)
+        exporter.export()
+        follower.save()
+
+    @staticmethod
+    def launch_gui():
+        try:
+            
+            subprocess.run(["streamlit", "run", "src/app/gui.py"], check=True)
+
+        except subprocess.CalledProcessError as e:
+
+            print("Failed to launch Streamlit app:", e)
+            sys.exit(1)
+
     # Method to parse the command-line arguements
     def handle_task(self): 
 
+        if self.args.serve:
+            self.serve()
+            return
+
+        if not self.args.task_id:
+            print("Error: task_id is required unless --serve is given")
+            sys.exit(1)
+
+        if self.args.import_times:
+            self.report_import_times(CLIHandler.parse_tasks(self.args.task_id))
+            return
+
+        if not self.args.profile:
+            self.run_tasks()
+            return
+
+        # A failing task still reports the stages that ran before it
+        try:
+            with Profiler() as profiler:
+                self.run_tasks()
+        finally:
+            self.report_profile(profiler)
+
+    def run_tasks(self):
+
+        if self.args.server and (self.args.since or self.args.until or self.args.approx is not None):
+            print("Error: --since/--until and --approx are not served; run the tasks without --server")
+            sys.exit(1)
+
+        if self.args.server:
+            self.run_remote_tasks(CLIHandler.parse_tasks(self.args.task_id))
+            return
+
         if not self.args.file_name: # checks if the user provided a file to analyze
                
             print("Error: file_name is required for all tasks except task 7") # if not we print an error
             sys.exit(1)
 
-        mainData = DataHandler.load_data(self.args.file_name)
+        tasks = CLIHandler.parse_tasks(self.args.task_id)
+        self.check_task_arguments(tasks)
 
-        if self.args.doc_uuid:
+        if self.args.clear_cache:
+            removed = DataHandler.clear_cache()
+            print(f"Removed {removed} cached file(s) from {DataHandler.CACHE_DIR}")
 
-            data = DataHandler.filter_data(self.args.file_name, self.args.doc_uuid)
+        DataHandler.use_cache = not self.args.no_cache
 
-        else:
+        window = self.time_window()
+        if window and (self.args.follow or self.args.store):
+            print("Error: --since/--until cannot be combined with --follow or --store, which cover whole files")
+            sys.exit(1)
 
-            # Load the data
-            data = DataHandler.load_data(self.args.file_name)
+        if self.args.approx is not None:
+            self.run_approximate_tasks(tasks, window)
+            return
+
+        if self.args.follow:
+            self.follow(tasks)
+            return
+
+        # With a store, 5d is answered by a lookup: the file is ingested only if the store has not seen this version
+        # of it, and aggregated only for the other tasks
+        store = None
+        if self.args.store and '5d' in tasks:
+            store = self.open_store()
+            store.ingest_file(self.args.file_name)
+
+        aggregates = None
+        remaining = [task for task in tasks if not (store and task == '5d')]
+        if remaining:
+            with Profiler.stage('aggregate'):
+                aggregates = self.aggregate(remaining, window)
+
+        # Charts of every task are written together at the end, sharing one renderer session
+        exporter = ChartExporter(format=self.args.format)
+
+        # Task 7 launches the GUI and blocks, so it always runs last
+        for task_id in sorted(tasks, key=lambda task: task == '7'):
+            if task_id == '7':
+                exporter.export()
+            with Profiler.stage(f"task {task_id}"):
+                self.run_task(task_id, aggregates, store, exporter)
+        exporter.export()
+
+    def top_k(self):
+        return self.args.top_k or 10
+
+    def open_store(self):
+        """ The also-likes store of --store; a store keeps the k it was created with, so another --top_k is an error. """
+        from src.analysis.alsoLikesStore import AlsoLikesStore
+
+        store = AlsoLikesStore(self.args.store, self.top_k())
+        if self.args.top_k is not None and self.args.top_k != store.top_k:
+            store.close()
+            print(f"Error: {self.args.store} keeps the top {store.top_k} also liked documents; "
+                  f"use --top_k {store.top_k} or a new --store path for --top_k {self.args.top_k}")
+            sys.exit(1)
+        return store
 
-        
-        if self.args.task_id == '2a':
+    def run_approximate_tasks(self, tasks, window=None):
+        """ Answer count and top-reader tasks from fixed-size sketches and report how far off they can be. """
+        from src.analysis.approximate_aggregates import ApproximateAggregates
 
-            country_count = GeoDataAnalyzer.get_country_counts(data)
-            GeoDataAnalyzer.saveAnalysisByCountry(country_count)
+        unsupported = [task for task in tasks if task not in ApproximateAggregates.TASKS]
+        if unsupported or window or self.args.follow or self.args.store:
+            print(f"Error: --approx supports tasks {', '.join(ApproximateAggregates.TASKS)} "
+                  "without --since/--until, --follow or --store")
+            sys.exit(1)
+        if not 0 < self.args.approx < 1:
+            print("Error: --approx takes a relative error between 0 and 1")
+            sys.exit(1)
 
-        elif self.args.task_id == '2b':
+        with Profiler.stage('aggregate'):
+            if self.args.workers > 1 and not DataHandler.has_cache(self.args.file_name):
+                aggregates = ApproximateAggregates.from_file_parallel(self.args.file_name, tasks, self.args.doc_uuid,
+                                                                      self.args.approx, self.args.workers)
+            else:
+                aggregates = ApproximateAggregates.from_file(self.args.file_name, tasks, self.args.doc_uuid, self.args.approx)
+
+        exporter = ChartExporter(format=self.args.format)
+        for task_id in tasks:
+            with Profiler.stage(f"task {task_id}"):
+                self.run_task(task_id, aggregates, exporter=exporter)
+        exporter.export()
+        aggregates.print_bounds()
+
+    def top_also_likes(self, analytics):
+        """ Exact top 10 also-likes of --doc_uuid, or the MinHash LSH estimate with --lsh. """
+        if not self.args.lsh:
+            return analytics.get_top_10_also_likes(self.args.doc_uuid)
+        return self.minhash_index(analytics).top_also_likes(self.args.doc_uuid)
+
+    def minhash_index(self, analytics):
+        """ Build the LSH index, first reporting its recall against the exact results when --lsh_recall is given. """
+        lsh = analytics.minhash_index(self.args.lsh_bands, self.args.lsh_rows)
+        if self.args.lsh_recall:
+            lsh.print_recall(self.args.lsh_recall)
+        return lsh
+
+    def run_task(self, task_id, aggregates, store=None, exporter=None):
+        """ Produce the output of one task from the shared aggregates. """
+        if task_id in ('2a', '2b'):
+            from src.analysis.geoDataAnalyzer import GeoDataAnalyzer
+        elif task_id in ('3a', '3b'):
+            from src.analysis.browserDataAnalyzer import BrowserDataAnalyzer
+        elif task_id == '4':
+            from src.analysis.viewerDataAnalyzer import ViewerDataAnalyzer
+        else:
+            from src.analysis.alsoLikesAnalyzer import AlsoLikesAnalyzer
 
-            continent_count = GeoDataAnalyzer.get_continent_counts(data)
-            GeoDataAnalyzer.saveAnalysisByContinent(continent_count)
-            
-        elif self.args.task_id == '3a':
+        if task_id == '2a':
 
-            detailed_browser_data = BrowserDataAnalyzer.process_browser_data(data, detailed=True)
-            BrowserDataAnalyzer.saveAnalysisByBrowser(detailed_browser_data,"detailed_browser_distribution")
+            country_count = aggregates.country_counts()
+            GeoDataAnalyzer.saveAnalysisByCountry(country_count, exporter=exporter)
 
-        elif self.args.task_id == '3b':
+        elif task_id == '2b':
 
-            detailed_browser_data = BrowserDataAnalyzer.process_browser_data(data, detailed=False)
-            BrowserDataAnalyzer.saveAnalysisByBrowser(detailed_browser_data,"browser_distribution",detailed=False)
+            continent_count = aggregates.continent_counts()
+            GeoDataAnalyzer.saveAnalysisByContinent(continent_count, exporter=exporter)
             
-        elif self.args.task_id == '4':
-                
-            top_readers = ViewerDataAnalyzer.calculate_reading_times(data)
-            ViewerDataAnalyzer.print_top_readers(top_readers)
+        elif task_id == '3a':
+
+            detailed_browser_data = aggregates.browser_counts(detailed=True)
+            BrowserDataAnalyzer.saveAnalysisByBrowser(detailed_browser_data,"detailed_browser_distribution", exporter=exporter)
 
-        elif self.args.task_id == '5d':
-        
-            if self.args.doc_uuid: #self.args.user_uuid and 
+        elif task_id == '3b':
 
-                analytics = AlsoLikesAnalyzer(mainData)
-                top_liked_docs = analytics.get_top_10_also_likes(self.args.doc_uuid)
-                analytics.print_top_liked_docs(top_liked_docs, self.args.doc_uuid)
+            detailed_browser_data = aggregates.browser_counts(detailed=False)
+            BrowserDataAnalyzer.saveAnalysisByBrowser(detailed_browser_data,"browser_distribution",detailed=False, exporter=exporter)
+            
+        elif task_id == '4':
                 
-            else:
+            top_readers = aggregates.top_readers(self.args.top_n)
+            ViewerDataAnalyzer.print_top_readers(top_readers, self.args.top_n)
 
-                print("Error: doc_uuid is required for task 5d")
-                sys.exit(1)
+        elif task_id == '5d' and store:
 
-        elif self.args.task_id == '6':
-            if self.args.user_uuid and self.args.doc_uuid:
+            top_liked_docs = store.lookup(self.args.doc_uuid)
+            AlsoLikesAnalyzer.print_top_liked_docs(top_liked_docs, self.args.doc_uuid)
 
-                analytics = AlsoLikesAnalyzer(mainData)
-                top_liked_docs = analytics.get_top_10_also_likes(self.args.doc_uuid)
-                graph = analytics.create_also_likes_graph(self.args.doc_uuid, self.args.user_uuid, top_liked_docs)
-                analytics.save_graph(graph, self.args.doc_uuid)
+        elif task_id == '5d':
 
-            else:
-                print("Error: doc_uuid and visitor_uuid is required for task 6")
-                sys.exit(1)
-        
-        elif self.args.task_id == '7':
+            analytics = AlsoLikesAnalyzer(aggregates.reading_pairs())
+            top_liked_docs = self.top_also_likes(analytics)
+            analytics.print_top_liked_docs(top_liked_docs, self.args.doc_uuid)
 
-            if self.args.user_uuid and self.args.doc_uuid:
+        elif task_id == '5e':
 
-                analytics = AlsoLikesAnalyzer(mainData)
-                top_liked_docs = analytics.get_top_10_also_likes(self.args.doc_uuid)
-                graph = analytics.create_also_likes_graph(self.args.doc_uuid, self.args.user_uuid, top_liked_docs)
-                analytics.save_graph(graph, self.args.doc_uuid)
+            analytics = AlsoLikesAnalyzer(aggregates.reading_pairs())
+            document_uuids = AlsoLikesAnalyzer.read_document_list(self.args.doc_list)
+            results = self.minhash_index(analytics).batch_also_likes(document_uuids, self.top_k()) if self.args.lsh else None
+            analytics.save_batch_also_likes(self.args.output, document_uuids, self.top_k(), results)
 
-            else:
-                print("Error: doc_uuid and visitor_uuid is required")
-                sys.exit(1)
+        elif task_id in ('6', '7'):
 
-            try:
-                
-                subprocess.run(["streamlit", "run", "src/app/gui.py"], check=True)
+            analytics = AlsoLikesAnalyzer(aggregates.reading_pairs())
+            top_liked_docs = self.top_also_likes(analytics)
+            graph = analytics.create_also_likes_graph(self.args.doc_uuid, self.args.user_uuid, top_liked_docs)
+            analytics.save_graph(graph, self.args.doc_uuid)
 
-            except subprocess.CalledProcessError as e:
+        if task_id == '7':
 
-                print("Failed to launch Streamlit app:", e)
-                sys.exit(1)
+            CLIHandler.launch_gui()
+
+    @staticmethod
+    def positive_int(value):
+        """ argparse type of counts such as -n and --top_k, which must be at least 1. """
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid int value: '{value}'") from None
+        if number < 1:
+            raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+        return number
 
     @staticmethod
     def parseCLI():
@@ -114,8 +483,32 @@ class CLIHandler:
         # Arguments to parse
         parser.add_argument('-u', '--user_uuid', type=str, help='This parameter takes in the user UUID for analysis')
         parser.add_argument('-d', '--doc_uuid', type=str, help='This parameter takes in the document UUID for analysis')
-        parser.add_argument('-t', '--task_id', type=str, required=True, help='This parameter takes in the Task ID, to execute a particular task')
-        parser.add_argument('-f', '--file_name', type=str, help='This parameter takes in the JSON file with input data')
+        parser.add_argument('-t', '--task_id', type=str, help='This parameter takes in the Task ID, or a comma separated list of Task IDs (e.g. 2a,2b,4) that share one pass over the data')
+        parser.add_argument('-f', '--file_name', type=str, help='This parameter takes in the JSON file with input data (plain, or compressed with gzip, bzip2, xz or zstd)')
+        parser.add_argument('-n', '--top_n', type=CLIHandler.positive_int, default=10, help='Task 4: number of top readers to list')
+        parser.add_argument('--doc_list', type=str, help="Task 5e: file with one document UUID per line, or 'all' for every document")
+        parser.add_argument('--top_k', type=CLIHandler.positive_int, help='Tasks 5e and --store: number of also liked documents kept per document (default 10; an existing store keeps its own)')
+        parser.add_argument('--output', type=str, default='output/batch_also_likes.csv', help='Task 5e: CSV or .jsonl file the batch results are written to')
+        parser.add_argument('--store', type=str, help='Task 5d: SQLite file holding a precomputed top-k also-likes table, updated incrementally with new files')
+        parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes that parse shards of the JSON file in parallel')
+        parser.add_argument('--format', type=str, default='png', choices=ChartExporter.FORMATS, help='Tasks 2a-3b: chart output format; html and csv skip the static-image renderer')
+        parser.add_argument('--no_cache', action='store_true', help='Parse the JSON file directly instead of using the on-disk Parquet cache')
+        parser.add_argument('--clear_cache', action='store_true', help='Delete everything under .cache before running the task: parsed Parquet logs, time indexes, rendered graphs, the user agent cache and --follow resume offsets')
+        parser.add_argument('--import_times', action='store_true', help='Measure the startup import time of each requested task instead of running it')
+        parser.add_argument('--profile', nargs='?', const='table', choices=['table', 'json'], help='Report wall time, rows and peak memory per stage (parsing, aggregation, UA parsing, Graphviz, export) as a table or JSON; memory tracing slows the run')
+        parser.add_argument('--profile_output', type=str, help='File the --profile report is written to instead of the console')
+        parser.add_argument('--since', type=str, help='Only count events at or after this time (epoch seconds or an ISO date/datetime in UTC)')
+        parser.add_argument('--until', type=str, help='Only count events before this time (epoch seconds or an ISO date/datetime in UTC)')
+        parser.add_argument('--bucket', type=str, default='hour', choices=['hour', 'day'], help='--since/--until: bucket size of the time index answering tasks 2a-4; rows of partial buckets at the window edges are read from the log')
+        parser.add_argument('--approx', nargs='?', type=float, const=0.001, help='Tasks 2a-4: answer from fixed-memory sketches (Space-Saving heavy hitters, HyperLogLog distinct readers) with this relative error (default 0.001) and print the error bounds')
+        parser.add_argument('--lsh', action='store_true', help='Tasks 5d-7: find also liked documents with a MinHash LSH index of reader sets instead of the exact co-read count')
+        parser.add_argument('--lsh_bands', type=int, default=32, help='--lsh: number of signature bands; more bands find less similar documents')
+        parser.add_argument('--lsh_rows', type=int, default=2, help='--lsh: signature rows per band; more rows make a band match stricter')
+        parser.add_argument('--lsh_recall', type=int, default=0, help='--lsh: report recall and lookup time against the exact results on this many sampled documents')
+        parser.add_argument('--follow', action='store_true', help='Keep reading lines appended to the file and refresh the task outputs as they arrive; progress is kept in the cache directory')
+        parser.add_argument('--interval', type=float, default=10, help='--follow: seconds between refreshed outputs')
+        parser.add_argument('--serve', nargs='?', const='127.0.0.1:8765', help="Load the file once and serve task queries on HOST:PORT or unix:/path/to.sock (default 127.0.0.1:8765)")
+        parser.add_argument('--server', type=str, help='Answer the tasks by querying a running --serve instance at HOST:PORT or unix:/path/to.sock instead of parsing the file')
         args, unknown = parser.parse_known_args()
 
         # Handle CLI logic based on arguments inputted
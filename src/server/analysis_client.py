@@ -0,0 +1,69 @@
+import http.client
+import json
+import socket
+from urllib.parse import urlencode
+
+import pandas as pd
+
+from .analysis_server import parse_address
+
+class AnalysisServerError(RuntimeError):
+
+    """ The server answered a query with an error (unknown task, missing parameter). """
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    """ HTTP over a Unix domain socket. """
+
+    def __init__(self, path, timeout=30):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class AnalysisClient:
+
+    """ Thin client of a running analysis server; results come back in the shapes the analyzers print and plot. """
+
+    def __init__(self, address, timeout=30):
+        self.address = address
+        self.kind, self.target = parse_address(address)
+        self.timeout = timeout
+
+    def connection(self):
+        if self.kind == 'unix':
+            return UnixHTTPConnection(self.target, self.timeout)
+        host, port = self.target
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def get(self, path, params=None):
+        """ GET a JSON endpoint; server-side errors are raised as AnalysisServerError. """
+        query = urlencode({name: value for name, value in (params or {}).items() if value is not None})
+        connection = self.connection()
+        try:
+            connection.request('GET', f"{path}?{query}" if query else path)
+            response = connection.getresponse()
+            payload = json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise AnalysisServerError(payload.get('error', f"HTTP {response.status}"))
+        return payload
+
+    def status(self):
+        return self.get('/status')
+
+    def task(self, task_id, **params):
+        return self.get(f"/task/{task_id}", params)['result']
+
+    @staticmethod
+    def series(payload):
+        """ Rebuild a count Series from the server's labels and values. """
+        return pd.Series(payload['values'], index=pd.Index(payload['index'], name=payload['index_name'], dtype=object),
+                         name=payload['name'], dtype=None if payload['values'] else 'int64')
@@ -0,0 +1,206 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+from ..analysis.data_handler import DataHandler
+from ..analysis.event_aggregates import EventAggregates
+from ..analysis.alsoLikesAnalyzer import AlsoLikesAnalyzer
+
+# Where the service listens unless --serve is given an address
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+
+class AnalysisService:
+
+    """ One dataset loaded and indexed once, answering task queries from shared in-memory state. """
+
+    TASKS = ['2a', '2b', '3a', '3b', '4', '5d', '6', '7']
+
+    def __init__(self, file_name, cache_size=256):
+        self.file_name = file_name
+        self.cache_size = cache_size
+        self.results = OrderedDict()
+        self.results_lock = threading.Lock()
+
+        # The user agent cache is shared mutable state, so browser roll-ups run one at a time
+        self.browser_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """ Parse the file once: the frame answers per-document queries, the aggregates and index everything else. """
+        start = time.perf_counter()
+        self.df = DataHandler.load_data(self.file_name, EventAggregates.columns_for(AnalysisService.TASKS))
+        self.aggregates = EventAggregates(AnalysisService.TASKS).update(self.df)
+        self.analytics = AlsoLikesAnalyzer(self.aggregates.reading_pairs())
+        self.analytics.build_index()
+        self.load_seconds = time.perf_counter() - start
+        self.loaded_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def status(self):
+        return {
+            'file_name': os.path.abspath(self.file_name),
+            'rows': len(self.df),
+            'loaded_at': self.loaded_at,
+            'load_seconds': round(self.load_seconds, 3),
+            'tasks': AnalysisService.TASKS,
+        }
+
+    def cached(self, key, compute):
+        """ Memoise a query result; concurrent misses may compute twice but never see partial state. """
+        with self.results_lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+                return self.results[key]
+
+        value = compute()
+        with self.results_lock:
+            self.results[key] = value
+            if len(self.results) > self.cache_size:
+                self.results.popitem(last=False)
+        return value
+
+    def aggregates_for(self, doc_uuid):
+        """ Aggregates of the whole file, or of the events of one document as the CLI's -d filter gives. """
+        if not doc_uuid:
+            return self.aggregates
+
+        def compute():
+            events = self.df[self.df['subject_doc_id'] == doc_uuid]
+            return EventAggregates(['2a', '3a', '4']).update(events)
+        return self.cached(('aggregates', doc_uuid), compute)
+
+    @staticmethod
+    def series_payload(series):
+        """ A count Series as JSON-friendly labels and values. """
+        return {
+            'name': series.name,
+            'index_name': series.index.name,
+            'index': [str(label) for label in series.index],
+            'values': series.tolist(),
+        }
+
+    @staticmethod
+    def required(params, *names):
+        missing = [name for name in names if not params.get(name)]
+        if missing:
+            raise ValueError(f"missing parameter(s): {', '.join(missing)}")
+        return [params[name] for name in names]
+
+    def query(self, task_id, params):
+        """ Answer one task with the same result the CLI computes locally. """
+        if task_id not in AnalysisService.TASKS:
+            raise KeyError(task_id)
+
+        doc_uuid = params.get('doc_uuid')
+        if task_id in ('2a', '2b', '3a', '3b', '4'):
+            top_n = int(params.get('top_n', 10))
+            if top_n < 1:
+                raise ValueError(f"top_n must be at least 1, got {top_n}")
+            key = (task_id, doc_uuid, top_n if task_id == '4' else None)
+            return self.cached(key, lambda: self.count_query(task_id, doc_uuid, top_n))
+
+        doc_uuid, = AnalysisService.required(params, 'doc_uuid')
+        top_liked_docs = self.cached(('5d', doc_uuid), lambda: self.analytics.get_top_10_also_likes(doc_uuid))
+        if task_id == '5d':
+            return AnalysisService.series_payload(top_liked_docs)
+
+        visitor_uuid, = AnalysisService.required(params, 'visitor_uuid')
+        graph = self.cached(('6', doc_uuid, visitor_uuid),
+                            lambda: self.analytics.create_also_likes_graph(doc_uuid, visitor_uuid, top_liked_docs))
+        return {'dot': graph.source}
+
+    def count_query(self, task_id, doc_uuid, top_n):
+        aggregates = self.aggregates_for(doc_uuid)
+        if task_id == '2a':
+            return AnalysisService.series_payload(aggregates.country_counts())
+        if task_id == '2b':
+            return AnalysisService.series_payload(aggregates.continent_counts())
+        if task_id == '4':
+            return AnalysisService.series_payload(aggregates.top_readers(top_n))
+
+        with self.browser_lock:
+            return AnalysisService.series_payload(aggregates.browser_counts(detailed=task_id == '3a'))
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+
+    """ GET /status and GET /task/<task_id>?doc_uuid=...&visitor_uuid=...&top_n=... returning JSON. """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        service = self.server.service
+
+        try:
+            if parts == ['status']:
+                self.send_json(200, service.status())
+            elif len(parts) == 2 and parts[0] == 'task':
+                start = time.perf_counter()
+                result = service.query(parts[1], params)
+                self.send_json(200, {'task': parts[1], 'result': result,
+                                     'seconds': round(time.perf_counter() - start, 6)})
+            else:
+                self.send_json(404, {'error': f"unknown path {url.path}"})
+        except KeyError as error:
+            self.send_json(404, {'error': f"task {error.args[0]} is not served"})
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class UnixAnalysisServer(ThreadingMixIn, UnixStreamServer):
+
+    daemon_threads = True
+
+
+def parse_address(address):
+    """ ('unix', path) for 'unix:/path.sock', otherwise ('tcp', (host, port)) for '[http://]host:port'. """
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+
+    host, _, port = address.replace('http://', '', 1).rstrip('/').rpartition(':')
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+def serve(service, address=DEFAULT_ADDRESS):
+    """ Serve queries until interrupted, one thread per request. """
+    kind, target = parse_address(address)
+    if kind == 'unix':
+        if os.path.exists(target):
+            os.remove(target)
+        server = UnixAnalysisServer(target, AnalysisRequestHandler)
+    else:
+        server = ThreadingHTTPServer(target, AnalysisRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+
+    # Stop cleanly (and remove the socket file) on kill as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    print(f"Serving {service.file_name} ({len(service.df)} rows, loaded in {service.load_seconds:.2f} s) on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if kind == 'unix' and os.path.exists(target):
+            os.remove(target)